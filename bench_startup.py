@@ -0,0 +1,144 @@
+"""
+Startup benchmark of the figure scripts.
+
+Each build module of ``MODULES`` is imported in a fresh interpreter,
+and the import time is measured. Importing these modules must not load
+any of the ``HEAVY_MODULES`` (which are only imported when needed), nor
+have side effects. The drawing modules (``geometry``, ``pycairo_utils``
+and the figures) are not checked: they import numpy and cairo right
+away, since they are only imported to draw. Imports run in an empty temporary directory, which must
+still be empty afterwards; since there is no stylesheet there, an import
+which loads the stylesheet fails. The end-to-end time of a dry run of
+``figures.py`` (which only checks which figures are stale) is also
+measured.
+
+The script exits with a non-zero status if an import or the dry run
+fails, if an import loads a heavy module or creates files, or if a time
+exceeds its limit (the best of ``--repeat`` runs is used)::
+
+    python bench_startup.py [--repeat N] [--max-import MS] [--max-dry-run MS]
+
+Run it from the directory of the stylesheet (like ``figures.py``).
+"""
+import argparse
+import json
+import os.path
+import subprocess
+import sys
+import tempfile
+import time
+
+MODULES = ["stylesheet", "labelling", "manifest", "figures"]
+HEAVY_MODULES = ["numpy", "cairo", "shapely", "PyPDF2", "geometry", "pycairo_utils"]
+SOURCE_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+
+PROBE = """
+import json, sys, time
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+import lazy
+print(json.dumps({{
+    "time": elapsed,
+    "heavy": [name for name in {heavy!r} if lazy.is_loaded(name)],
+}}))
+"""
+
+
+def probe_import(module):
+    """Import ``module`` in a fresh interpreter, in an empty directory.
+
+    Returns the import time (in seconds), the list of heavy modules which
+    were loaded, and the list of side effects (error, created files).
+    """
+    code = PROBE.format(module=module, heavy=HEAVY_MODULES)
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(
+        filter(None, [SOURCE_DIRECTORY, env.get("PYTHONPATH")])
+    )
+    with tempfile.TemporaryDirectory() as directory:
+        process = subprocess.run(
+            [sys.executable, "-c", code],
+            cwd=directory,
+            env=env,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            universal_newlines=True,
+        )
+        side_effects = ["creates " + name for name in sorted(os.listdir(directory))]
+    if process.returncode != 0:
+        error = process.stderr.strip().splitlines() or ["no output"]
+        return None, [], ["fails: " + error[-1]] + side_effects
+    result = json.loads(process.stdout.splitlines()[-1])
+    return result["time"], result["heavy"], side_effects
+
+
+def time_dry_run():
+    """Return the wall-clock time (in seconds) of ``figures.py --dry-run``.
+
+    Returns ``None`` and the error message if the dry run fails.
+    """
+    start = time.perf_counter()
+    process = subprocess.run(
+        [sys.executable, os.path.join(SOURCE_DIRECTORY, "figures.py"), "--dry-run"],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        universal_newlines=True,
+    )
+    if process.returncode != 0:
+        error = process.stderr.strip().splitlines() or ["no output"]
+        return None, error[-1]
+    return time.perf_counter() - start, None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the startup time.")
+    parser.add_argument("--repeat", type=int, default=5, help="number of runs")
+    parser.add_argument(
+        "--max-import",
+        type=float,
+        default=150.0,
+        help="maximum import time of each module (in ms)",
+    )
+    parser.add_argument(
+        "--max-dry-run",
+        type=float,
+        default=500.0,
+        help="maximum time of a dry run of figures.py (in ms)",
+    )
+    args = parser.parse_args(argv)
+
+    failures = []
+    for module in MODULES:
+        runs = [probe_import(module) for _ in range(args.repeat)]
+        side_effects = sorted(set().union(*(s for _, _, s in runs)))
+        if side_effects:
+            print("import {:<12} FAILED".format(module))
+            failures.extend("{} {}".format(module, s) for s in side_effects)
+            continue
+        best = 1000 * min(t for t, _, _ in runs)
+        heavy = sorted(set().union(*(h for _, h, _ in runs)))
+        print("import {:<12} {:8.1f} ms".format(module, best))
+        if heavy:
+            failures.append("{} loads {}".format(module, ", ".join(heavy)))
+        if best > args.max_import:
+            failures.append("import of {} takes {:.1f} ms".format(module, best))
+
+    runs = [time_dry_run() for _ in range(args.repeat)]
+    errors = sorted(set(e for _, e in runs if e is not None))
+    if errors:
+        print("figures.py --dry-run FAILED")
+        failures.extend("dry run fails: " + e for e in errors)
+    else:
+        best = 1000 * min(t for t, _ in runs)
+        print("figures.py --dry-run {:8.1f} ms".format(best))
+        if best > args.max_dry_run:
+            failures.append("dry run takes {:.1f} ms".format(best))
+
+    for failure in failures:
+        print("FAILED: " + failure)
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
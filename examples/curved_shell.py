@@ -0,0 +1,87 @@
+"""
+Example: a curved shell drawn with hidden surfaces and lines removed.
+
+The boundary of the shell is tessellated (``geometry.tessellate()``), and
+drawn with the painter's algorithm (``pycairo_utils.draw_mesh()``). This
+is not one of the figures of the course: run it from the directory of the
+stylesheet with
+
+    python -m examples.curved_shell
+
+which produces ``curved-shell.pdf`` in the output directory.
+"""
+import cairo
+import numpy as np
+
+import geometry
+import stylesheet
+
+from labelling import insert_labels, Label
+from pycairo_utils import draw_frame, draw_mesh
+
+
+def main():
+    basename = "curved-shell"
+    filename = stylesheet.full_path(basename + "-bare.pdf")
+
+    shell = geometry.default_shell(plate=False, constant_thickness=False)
+
+    u = np.linspace(-15.0, 15.0, 31)
+    v = np.linspace(-20.0, 20.0, 41)
+    mesh = geometry.tessellate(shell, u, v, iso_u=[0.0], iso_v=[0.0])
+
+    colors = [stylesheet.color("system", "light")] + 5 * [
+        stylesheet.color("system", "medium")
+    ]
+
+    with cairo.PDFSurface(filename, 1, 1) as surface:
+        ctx = stylesheet.init_cairo_context(surface)
+
+        ctx.set_source_rgb(0.0, 0.0, 0.0)
+        ctx.set_line_width(stylesheet.line_width("normal"))
+        draw_mesh(ctx, mesh, colors)
+
+        labels = []
+
+        dx, dy = 5.0, 5.0
+
+        ctx.set_line_width(stylesheet.line_width("thin"))
+        x1, y1 = geometry.project(*shell.f_sup(-7.5, 10.0))
+        x2, y2 = x1 + dx, y1 + dy
+        ctx.move_to(x1, y1)
+        ctx.line_to(x2, y2)
+        ctx.stroke()
+        labels.append(
+            Label(
+                r"\(\partial\Omega^+\)",
+                ctx.user_to_device(x2, y2),
+                (0.0, 0.0),
+                y_upwards=False,
+            )
+        )
+
+        x1, y1 = geometry.project(*shell.evaluate(15.0, -10.0).mid)
+        x2, y2 = x1 - dx, y1 - dy
+        ctx.move_to(x1, y1)
+        ctx.line_to(x2, y2)
+        ctx.stroke()
+        labels.append(
+            Label(
+                r"\(\Omega\)",
+                ctx.user_to_device(x2, y2),
+                (1.0, 1.0),
+                y_upwards=False,
+            )
+        )
+
+        ctx.save()
+        ctx.translate(-28.0, 17.0)
+        ctx.set_source_rgb(*stylesheet.color("unit-vector"))
+        draw_frame(ctx, labels)
+        ctx.restore()
+
+    insert_labels(basename, labels)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,20 +1,37 @@
 import os.path
 
-from itertools import chain, repeat, starmap
-
 import cairo
 import numpy as np
-import shapely.geometry
+import shapely
 
 import stylesheet
 
-from pycairo_utils import draw_polyline
-from geometry import default_shell, Ellipse, project
+from pycairo_utils import draw_polyline, draw_polylines
+from geometry import (
+    adaptive_sample,
+    as_points,
+    default_shell,
+    Ellipse,
+    project,
+    sample_shell,
+)
 from labelling import insert_labels, Label
 
 
+def linestrings(*coords):
+    """Return an array of line strings, given their ``(N, 2)`` coordinates."""
+    indices = np.repeat(np.arange(len(coords)), [len(xy) for xy in coords])
+    return shapely.linestrings(np.concatenate(coords), indices=indices)
+
+
+def coordinates(geometries):
+    """Return the list of the ``(N, 2)`` coordinates of ``geometries``."""
+    xy, index = shapely.get_coordinates(geometries, return_index=True)
+    return np.split(xy, np.searchsorted(index, np.arange(1, len(geometries))))
+
+
 class ShellWithSubSystem:
-    def __init__(self, shell, border, u, v, t, u_cut, v_cut):
+    def __init__(self, shell, border, u, v, t, u_cut, v_cut, projection=project):
         """Shell is cut along two lines: ``u = u_cut`` and ``v = v_cut``.
 
         It is assumed that the visible sector is ``u ≥ u_cut`` and ``v ≥ v_cut``.
@@ -22,13 +39,14 @@ class ShellWithSubSystem:
         """
         self.shell = shell
         self.border = border
+        self.projection = projection
         self.u = np.asarray(u)
         self.v = np.asarray(v)
         self.t = np.asarray(t)
         self.u_cut = u_cut
         self.v_cut = v_cut
 
-        self.Γ = shapely.geometry.Polygon(self.border(t_) for t_ in t)
+        self.Γ = shapely.polygons(self.border(self.t))
 
         self.u_min, self.u_max = np.min(self.u), np.max(self.u)
         self.v_min, self.v_max = np.min(self.v), np.max(self.v)
@@ -36,136 +54,121 @@ class ShellWithSubSystem:
         u_ge = u >= u_cut
         v_le = v <= v_cut
         v_ge = v >= v_cut
-        self.Σ = shapely.geometry.Polygon(
-            chain(
-                zip(repeat(u_cut), v[v_ge]),
-                zip(u[u_le][::-1], repeat(self.v_max)),
-                zip(repeat(self.u_min), v[::-1]),
-                zip(u, repeat(self.v_min)),
-                zip(repeat(self.u_max), v[v_le]),
-                zip(u[u_ge][::-1], repeat(v_cut)),
+        self.Σ = shapely.polygons(
+            np.concatenate(
+                [
+                    as_points(u_cut, v[v_ge]),
+                    as_points(u[u_le][::-1], self.v_max),
+                    as_points(self.u_min, v[::-1]),
+                    as_points(u, self.v_min),
+                    as_points(self.u_max, v[v_le]),
+                    as_points(u[u_ge][::-1], v_cut),
+                ]
             )
         )
+        shapely.prepare(self.Γ)
+        shapely.prepare(self.Σ)
 
-        self.Γ_visible = self.Γ.exterior.difference(self.Σ)
+        self.Γ_visible = shapely.difference(self.Γ.exterior, self.Σ)
 
     def pf_sup(self, u, v):
-        return project(*self.shell.f_sup(u, v))
+        return self.projection.points(self.shell.f_sup(u, v))
 
     def pf_inf(self, u, v):
-        return project(*self.shell.f_inf(u, v))
+        return self.projection.points(self.shell.f_inf(u, v))
 
     def pf_mid(self, u, v):
-        return project(*self.shell.f_mid(u, v))
+        return self.projection.points(self.shell.f_mid(u, v))
 
     def draw_bare(self, ctx, labels):
-        iso_u = shapely.geometry.LineString(zip(repeat(self.u_cut), self.v))
-        iso_v = shapely.geometry.LineString(zip(self.u, repeat(self.v_cut)))
-
-        i = self.v >= self.v_cut
-        AC = shapely.geometry.LineString(zip(repeat(self.u_cut), self.v[i]))
-
-        i = self.u <= self.u_cut
-        CD = shapely.geometry.LineString(zip(self.u[i][::-1], repeat(self.v_max)))
-
-        i = self.v <= self.v_cut
-        FG = shapely.geometry.LineString(zip(repeat(self.u_max), self.v[i]))
-
-        i = self.u >= self.u_cut
-        GA = shapely.geometry.LineString(zip(self.u[i][::-1], repeat(self.v_cut)))
-
-        GH = GA.difference(self.Γ)
-        BC = AC.difference(self.Γ)
+        u, v = self.u, self.v
+        iso, (AC, CD, FG, GA) = np.split(
+            linestrings(
+                as_points(self.u_cut, v),
+                as_points(u, self.v_cut),
+                as_points(self.u_cut, v[v >= self.v_cut]),
+                as_points(u[u <= self.u_cut][::-1], self.v_max),
+                as_points(self.u_max, v[v <= self.v_cut]),
+                as_points(u[u >= self.u_cut][::-1], self.v_cut),
+            ),
+            [2],
+        )
+        GH, BC = shapely.difference([GA, AC], self.Γ)
+        fg, gh, bc, cd = coordinates([FG, GH, BC, CD])
+        γ, γ_visible = coordinates([self.Γ.exterior, self.Γ_visible])
 
         # Upper face of outer system
         ctx.set_source_rgb(*stylesheet.color("system", "light"))
-        draw_polyline(
-            ctx,
-            starmap(self.pf_sup, self.Σ.difference(self.Γ).exterior.coords),
-        )
-        ctx.close_path()
+        outer = shapely.get_exterior_ring(shapely.difference(self.Σ, self.Γ))
+        draw_polyline(ctx, self.pf_sup(*shapely.get_coordinates(outer).T), close=True)
         ctx.fill()
 
         # Upper face of sub-system
         ctx.set_source_rgb(*stylesheet.color("sub-system", "light"))
-        draw_polyline(ctx, starmap(self.pf_sup, self.Γ.exterior.coords))
-        ctx.close_path()
+        draw_polyline(ctx, self.pf_sup(*γ.T), close=True)
         ctx.fill()
 
         # Lateral face of outer system
-        def draw_lateral(uv):
-            points = chain(starmap(self.pf_inf, uv), starmap(self.pf_sup, uv[::-1]))
-            ctx.move_to(*next(points))
-            for x, y in points:
-                ctx.line_to(x, y)
-            ctx.close_path()
+        def lateral(uv):
+            points = self.shell.evaluate(*uv.T)
+            return self.projection.points(
+                np.concatenate([points.inf, points.sup[::-1]])
+            )
 
         ctx.set_source_rgb(*stylesheet.color("system", "medium"))
-        draw_lateral(FG.coords)
-        draw_lateral(BC.coords)
+        draw_polylines(ctx, [lateral(fg), lateral(bc)], close=True)
         ctx.fill()
 
         ctx.set_source_rgb(*stylesheet.color("system", "dark"))
-        draw_lateral(CD.coords)
-        draw_lateral(GH.coords)
+        draw_polylines(ctx, [lateral(cd), lateral(gh)], close=True)
         ctx.fill()
 
         # Lateral face of sub-system
         ctx.set_source_rgb(*stylesheet.color("sub-system", "medium"))
-        points = chain(
-            starmap(self.pf_inf, self.Γ_visible.coords),
-            starmap(self.pf_sup, self.Γ_visible.coords[::-1]),
-        )
-        ctx.move_to(*next(points))
-        for x, y in points:
-            ctx.line_to(x, y)
-        ctx.close_path()
+        draw_polyline(ctx, lateral(γ_visible), close=True)
         ctx.fill()
 
         # Iso-lines, outer system
         ctx.set_line_width(stylesheet.line_width("thin"))
         ctx.set_source_rgb(0.0, 0.0, 0.0)
 
-        for iso, index, bound in [(iso_u, 1, self.v_cut), (iso_v, 0, self.u_cut)]:
-            mls = iso.difference(self.Γ)
-            for ls in mls:
-                if ls.coords[0][index] <= bound:
-                    points = starmap(self.pf_sup, ls.coords)
-                    ctx.move_to(*next(points))
-                    for x, y in points:
-                        ctx.line_to(x, y)
+        parts, i = shapely.get_parts(shapely.difference(iso, self.Γ), return_index=True)
+        index = np.array([1, 0])[i]
+        bound = np.array([self.v_cut, self.u_cut])[i]
+        draw_polylines(
+            ctx,
+            [
+                self.pf_sup(*uv.T)
+                for uv, index_, bound_ in zip(coordinates(parts), index, bound)
+                if uv[0, index_] <= bound_
+            ],
+        )
         ctx.stroke()
 
         # Upper and lower faces of outer system
         ctx.set_line_width(stylesheet.line_width("normal"))
-        points = starmap(self.pf_sup, self.Σ.exterior.difference(self.Γ).coords)
-        ctx.move_to(*next(points))
-        for x, y in points:
-            ctx.line_to(x, y)
-        points = chain(starmap(self.pf_inf, FG.coords), starmap(self.pf_inf, GH.coords))
-        ctx.move_to(*next(points))
-        for x, y in points:
-            ctx.line_to(x, y)
-        points = chain(starmap(self.pf_inf, BC.coords), starmap(self.pf_inf, CD.coords))
-        ctx.move_to(*next(points))
-        for x, y in points:
-            ctx.line_to(x, y)
+        outer = shapely.difference(self.Σ.exterior, self.Γ)
+        draw_polylines(
+            ctx,
+            [
+                self.pf_sup(*shapely.get_coordinates(outer).T),
+                self.pf_inf(*np.concatenate([fg, gh]).T),
+                self.pf_inf(*np.concatenate([bc, cd]).T),
+            ],
+        )
         ctx.stroke()
 
         # Mid surface
         ctx.set_line_width(stylesheet.line_width("thin"))
         ctx.set_source_rgb(*stylesheet.color("mid-surface"))
-        points = starmap(
-            self.pf_mid,
-            chain(FG.coords, GH.coords, self.Γ.exterior.difference(self.Σ).coords),
+        γ_hidden = shapely.get_coordinates(shapely.difference(self.Γ.exterior, self.Σ))
+        draw_polylines(
+            ctx,
+            [
+                self.pf_mid(*np.concatenate([fg, gh, γ_hidden]).T),
+                self.pf_mid(*np.concatenate([bc, cd]).T),
+            ],
         )
-        ctx.move_to(*next(points))
-        for x, y in points:
-            ctx.line_to(x, y)
-        points = starmap(self.pf_mid, chain(BC.coords, CD.coords))
-        ctx.move_to(*next(points))
-        for x, y in points:
-            ctx.line_to(x, y)
         ctx.stroke()
 
         # Fibers of outer system
@@ -183,19 +186,17 @@ class ShellWithSubSystem:
 
         # Sub-system
         ctx.set_source_rgb(*stylesheet.color("sub-system"))
-        draw_polyline(ctx, starmap(self.pf_sup, self.Γ.exterior.coords))
-        draw_polyline(ctx, starmap(self.pf_inf, self.Γ_visible.coords))
+        draw_polylines(ctx, [self.pf_sup(*γ.T), self.pf_inf(*γ_visible.T)])
         ctx.stroke()
 
         # Sub-system iso-[u, v] lines and fibers
         ctx.set_line_width(stylesheet.line_width("thin"))
 
-        for iso in (iso_u, iso_v):
-            ls = iso.intersection(self.Γ)
-            draw_polyline(ctx, starmap(self.pf_sup, ls.coords))
-            ctx.line_to(*self.pf_inf(*ls.coords[-1]))
+        for uv in coordinates(shapely.intersection(iso, self.Γ)):
+            draw_polyline(ctx, self.pf_sup(*uv.T))
+            ctx.line_to(*self.pf_inf(*uv[-1]))
 
-        for u_, v_ in (self.Γ_visible.coords[0], self.Γ_visible.coords[-1]):
+        for u_, v_ in (γ_visible[0], γ_visible[-1]):
             ctx.move_to(*self.pf_inf(u_, v_))
             ctx.line_to(*self.pf_sup(u_, v_))
         ctx.stroke()
@@ -253,10 +254,16 @@ def main():
     shell = default_shell(plate=True, constant_thickness=False)
     border = Ellipse(7.0, 10.0)
 
-    u = np.linspace(-15.0, 15.0, num=51)
-    v = np.linspace(-20.0, 20.0, num=51)
-    t = np.linspace(0.0, 2 * np.pi, num=51)
     u_cut, v_cut = 0.0, 0.0
+    tol = stylesheet.chord_tolerance()
+    u = sample_shell(shell, [-15.0, u_cut, 15.0], [-20.0, v_cut, 20.0], tol, "u")
+    v = sample_shell(shell, [-20.0, v_cut, 20.0], [-15.0, u_cut, 15.0], tol, "v")
+
+    def sub_system_border(t):
+        points = shell.evaluate(*np.moveaxis(border(t), -1, 0))
+        return project.points(np.stack([points.mid, points.inf, points.sup], axis=1))
+
+    t = adaptive_sample(sub_system_border, [0.0, 2 * np.pi], tol)
 
     drawing = ShellWithSubSystem(
         shell,
@@ -8,15 +8,19 @@ import shapely
 
 import stylesheet
 
-from geometry import default_shell, project
+from geometry import as_points, default_shell, project, sample_shell
 from labelling import Label, insert_labels
-from pycairo_utils import draw_frame, draw_polyline
+from pycairo_utils import build_path, draw_frame, draw_polyline
 
 
-def draw_left(shell, u, v, u_cut, basename):
-    pf_sup = lambda u, v: project(*shell.f_sup(u, v))
-    pf_inf = lambda u, v: project(*shell.f_inf(u, v))
-    pf_mid = lambda u, v: project(*shell.f_mid(u, v))
+def draw_left(shell, u, v, u_cut, basename, projection=project):
+    pf_sup = lambda u, v: projection.points(shell.f_sup(u, v))
+    pf_inf = lambda u, v: projection.points(shell.f_inf(u, v))
+    pf_mid = lambda u, v: projection.points(shell.f_mid(u, v))
+
+    def pf_lateral(u, v):
+        points = shell.evaluate(u, v)
+        return projection.points(np.concatenate([points.inf, points.sup[::-1]]))
 
     filename = stylesheet.full_path(basename + "-bare.pdf")
     with cairo.PDFSurface(filename, 1, 1) as surface:
@@ -24,37 +28,28 @@ def draw_left(shell, u, v, u_cut, basename):
         ctx.set_line_width(stylesheet.line_width("normal"))
 
         ctx.set_source_rgb(*stylesheet.color("system", "light"))
-        ctx.move_to(*pf_sup(u[0], v[0]))
-        for u_ in u[1:]:
-            ctx.line_to(*pf_sup(u_, v[0]))
-        for v_ in v:
-            ctx.line_to(*pf_sup(u[-1], v_))
-        for u_ in u[::-1]:
-            ctx.line_to(*pf_sup(u_, v[-1]))
-        for v_ in v[::-1]:
-            ctx.line_to(*pf_sup(u[0], v_))
-        ctx.close_path()
-        upper_surface = ctx.copy_path()
+        upper_surface = build_path(
+            ctx,
+            [
+                np.concatenate(
+                    [
+                        pf_sup(u, v[0]),
+                        pf_sup(u[-1], v),
+                        pf_sup(u[::-1], v[-1]),
+                        pf_sup(u[0], v[::-1]),
+                    ]
+                )
+            ],
+            close=True,
+        )
         ctx.fill()
 
         ctx.set_source_rgb(*stylesheet.color("system", "medium"))
-        ctx.move_to(*pf_inf(u[-1], v[0]))
-        for v_ in v[1:]:
-            ctx.line_to(*pf_inf(u[-1], v_))
-        for v_ in v[::-1]:
-            ctx.line_to(*pf_sup(u[-1], v_))
-        ctx.close_path()
-        lateral_surface_100 = ctx.copy_path()
+        lateral_surface_100 = build_path(ctx, [pf_lateral(u[-1], v)], close=True)
         ctx.fill()
 
         ctx.set_source_rgb(*stylesheet.color("system", "dark"))
-        ctx.move_to(*pf_inf(u[0], v[-1]))
-        for u_ in u[1:]:
-            ctx.line_to(*pf_inf(u_, v[-1]))
-        for u_ in u[::-1]:
-            ctx.line_to(*pf_sup(u_, v[-1]))
-        ctx.close_path()
-        lateral_surface_010 = ctx.copy_path()
+        lateral_surface_010 = build_path(ctx, [pf_lateral(u, v[-1])], close=True)
         ctx.fill()
 
         ctx.set_source_rgb(0.0, 0.0, 0.0)
@@ -64,29 +59,29 @@ def draw_left(shell, u, v, u_cut, basename):
         ctx.stroke()
 
         ctx.set_source_rgb(*stylesheet.color("mid-surface"))
-        ctx.move_to(*pf_mid(u[-1], v[0]))
-        for v_ in v[1:]:
-            ctx.line_to(*pf_mid(u[-1], v_))
-        for u_ in u[::-1]:
-            ctx.line_to(*pf_mid(u_, v[-1]))
+        draw_polyline(ctx, np.concatenate([pf_mid(u[-1], v), pf_mid(u[::-1], v[-1])]))
         ctx.stroke()
 
         ctx.set_source_rgba(*stylesheet.color("cutting-plane"), 0.5)
-        FG = shapely.geometry.LineString(pf_sup(u_cut, v_) for v_ in v)
+        FG = shapely.geometry.LineString(pf_sup(u_cut, v))
 
         x = 0.0
         y1, z1 = v[0] - 10.0, -10.0
         y2, z2 = v[-1] + 10.0, 10.0
-        ls1 = shapely.geometry.LineString((project(x, y1, z1), project(x, y2, z1)))
-        ls2 = shapely.geometry.LineString(pf_inf(u_, v[-1]) for u_ in u)
+        ls1 = shapely.geometry.LineString(
+            (projection(x, y1, z1), projection(x, y2, z1))
+        )
+        ls2 = shapely.geometry.LineString(pf_inf(u, v[-1]))
         A = ls1.intersection(ls2)
-        B = shapely.geometry.Point(*project(x, y2, z1))
-        C = shapely.geometry.Point(*project(x, y2, z2))
-        D = shapely.geometry.Point(*project(x, y1, z2))
+        B = shapely.geometry.Point(*projection(x, y2, z1))
+        C = shapely.geometry.Point(*projection(x, y2, z2))
+        D = shapely.geometry.Point(*projection(x, y1, z2))
         H = shapely.geometry.Point(*pf_inf(u_cut, v[-1]))
 
-        ls1 = shapely.geometry.LineString(pf_sup(u_, v[0]) for u_ in u[::-1])
-        ls2 = shapely.geometry.LineString((project(x, y1, z1), project(x, y1, z2)))
+        ls1 = shapely.geometry.LineString(pf_sup(u[::-1], v[0]))
+        ls2 = shapely.geometry.LineString(
+            (projection(x, y1, z1), projection(x, y1, z2))
+        )
         E = ls1.intersection(ls2)
         F = ls1.intersection(FG)
 
@@ -94,17 +89,12 @@ def draw_left(shell, u, v, u_cut, basename):
         EF = rect.intersection(ls1)
 
         rect = shapely.geometry.Polygon([A, (H.x, A.y), H, (A.x, H.y)])
-        HA = rect.intersection(
-            shapely.geometry.LineString(pf_inf(u_, v[-1]) for u_ in u)
-        )
+        HA = rect.intersection(shapely.geometry.LineString(pf_inf(u, v[-1])))
 
-        ctx.move_to(A.x, A.y)
-        ctx.line_to(B.x, B.y)
-        ctx.line_to(C.x, C.y)
-        ctx.line_to(D.x, D.y)
-        draw_polyline(ctx, chain(EF.coords, FG.coords, HA.coords), move_to_first=False)
-        ctx.close_path()
-        cutting_plane = ctx.copy_path()
+        ABCD = [(A.x, A.y), (B.x, B.y), (C.x, C.y), (D.x, D.y)]
+        cutting_plane = build_path(
+            ctx, [list(chain(ABCD, EF.coords, FG.coords, HA.coords))], close=True
+        )
         ctx.fill()
 
         ctx.set_line_width(stylesheet.line_width("thin"))
@@ -126,7 +116,7 @@ def draw_left(shell, u, v, u_cut, basename):
 
         dx, dy = 5.0, 5.0
 
-        ls = shapely.geometry.LineString(pf_mid(u[-1], v_) for v_ in v)
+        ls = shapely.geometry.LineString(pf_mid(u[-1], v))
         p1 = ls.interpolate(0.5, normalized=True)
         x2, y2 = p1.x - dx, p1.y - dy
         ctx.move_to(p1.x, p1.y)
@@ -138,7 +128,7 @@ def draw_left(shell, u, v, u_cut, basename):
             )
         )
 
-        ls = shapely.geometry.LineString(pf_inf(u[-1], v_) for v_ in v)
+        ls = shapely.geometry.LineString(pf_inf(u[-1], v))
         p1 = ls.interpolate(0.75, normalized=True)
         x2, y2 = p1.x - dx, p1.y - dy
         ctx.move_to(p1.x, p1.y)
@@ -172,7 +162,7 @@ def draw_left(shell, u, v, u_cut, basename):
             )
         )
 
-        ls = shapely.geometry.LineString(pf_sup(u[0], v_) for v_ in v)
+        ls = shapely.geometry.LineString(pf_sup(u[0], v))
         p1 = ls.interpolate(0.25, normalized=True)
         x2, y2 = p1.x + dx, p1.y + dy
         ctx.move_to(p1.x, p1.y)
@@ -189,13 +179,13 @@ def draw_left(shell, u, v, u_cut, basename):
         ctx.set_source_rgb(*stylesheet.color("unit-vector"))
         ctx.save()
         ctx.translate(30.0, 17.0)
-        draw_frame(ctx, labels)
+        draw_frame(ctx, labels, projection)
         ctx.restore()
 
     insert_labels(basename, labels)
 
 
-def draw_right(u, v, basename):
+def draw_right(u, v, basename, projection=project):
     filename = stylesheet.full_path(basename + "-bare.pdf")
     with cairo.PDFSurface(filename, 1, 1) as surface:
         ctx = stylesheet.init_cairo_context(surface)
@@ -205,10 +195,8 @@ def draw_right(u, v, basename):
             (u[0], v[-1]),
             (u[0], v[0]),
         ]
-        xy = (project(u_, v_, 0.0) for u_, v_ in uv)
-        draw_polyline(ctx, xy)
-        ctx.close_path()
-        plate = ctx.copy_path()
+        u_, v_ = np.transpose(uv)
+        plate = build_path(ctx, [projection.points(as_points(u_, v_, 0.0))], close=True)
 
         ctx.set_source_rgb(*stylesheet.color("system", "light"))
         ctx.fill()
@@ -221,12 +209,12 @@ def draw_right(u, v, basename):
         ctx.set_line_width(stylesheet.line_width("thin"))
         ctx.set_source_rgb(*stylesheet.color("unit-vector"))
         labels = []
-        draw_frame(ctx, labels)
+        draw_frame(ctx, labels, projection)
 
         labels.append(
             Label(
                 r"\(\Sigma\)",
-                ctx.user_to_device(*project(0.75 * u[-1], 0.75 * v[0], 0.0)),
+                ctx.user_to_device(*projection(0.75 * u[-1], 0.75 * v[0], 0.0)),
                 (0.5, 0.5),
                 y_upwards=False,
             )
@@ -239,10 +227,10 @@ def main():
     basename = "fig20210113144259"
     shell = default_shell(plate=True, constant_thickness=False)
 
-    u = np.linspace(-15.0, 15.0, num=51)
-    v = np.linspace(-20.0, 20.0, num=51)
-
     u_cut = 0.0
+    tol = stylesheet.chord_tolerance()
+    u = sample_shell(shell, [-15.0, u_cut, 15.0], [-20.0, 20.0], tol, "u")
+    v = sample_shell(shell, [-20.0, 20.0], [-15.0, u_cut, 15.0], tol, "v")
 
     draw_left(shell, u, v, u_cut, basename + "-left")
     draw_right(u, v, basename + "-right")
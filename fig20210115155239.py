@@ -1,5 +1,3 @@
-from itertools import chain
-
 import cairo
 import numpy as np
 
@@ -7,7 +5,13 @@ import geometry
 import stylesheet
 
 from labelling import insert_labels, Label
-from pycairo_utils import draw_frame_2d, draw_mark, draw_polyline, draw_arrow_head
+from pycairo_utils import (
+    build_path,
+    draw_arrow_head,
+    draw_frame_2d,
+    draw_mark,
+    draw_polyline,
+)
 
 
 def main():
@@ -16,21 +20,18 @@ def main():
 
     shell = geometry.default_shell(plate=True, constant_thickness=False)
 
+    project = geometry.Projection.orthographic((-1.0, 0.0, 0.0))
+
     u = 0.0
-    v = np.linspace(-20.0, 20.0, num=51)
+    tol = stylesheet.chord_tolerance()
+    v = geometry.sample_shell(shell, [-20.0, 20.0], [u], tol, "v", projection=project)
 
     with cairo.PDFSurface(filename, 1, 1) as surface:
         ctx = stylesheet.init_cairo_context(surface)
 
-        project = lambda x, y, z: (y, z)
-
-        points = chain(
-            (project(*shell.f_inf(u, v_)) for v_ in v),
-            (project(*shell.f_sup(u, v_)) for v_ in v[::-1]),
-        )
-        draw_polyline(ctx, points)
-        ctx.close_path()
-        path = ctx.copy_path()
+        points = shell.evaluate(u, v)
+        points = np.concatenate([points.inf, points.sup[::-1]])
+        path = build_path(ctx, [project.points(points)], close=True)
 
         ctx.set_source_rgb(*stylesheet.color("system", "medium"))
         ctx.fill()
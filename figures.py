@@ -1,8 +1,290 @@
-import fig20210105175723
-import fig20210113144259
-import fig20210115155239
+import argparse
+import concurrent.futures
+import fnmatch
+import glob
+import importlib
+import os
+import os.path
+import sys
+import time
+import traceback
+
+import labelling
+import manifest
+import stylesheet
+
+from lazy import lazy_import
+
+# Only needed to generate figures (it imports numpy)
+geometry = lazy_import("geometry")
+
+FIGURE_PATTERN = "fig[0-9]*.py"
+WATCH_INTERVAL = 0.25
+
+
+def discover_figures():
+    """Return the names of the figure modules, without importing them.
+
+    Figure modules are named ``fig<timestamp>.py``, and define a ``main()``
+    function which generates all their figures (e.g. all panels).
+    """
+    filenames = glob.glob(os.path.join(manifest.SOURCE_DIRECTORY, FIGURE_PATTERN))
+    return sorted(os.path.splitext(os.path.basename(f))[0] for f in filenames)
+
+
+def select_figures(patterns, names, build_manifest):
+    """Return the figure modules (among ``names``) matching ``patterns``.
+
+    Patterns are names or globs. They are matched against the name of the
+    modules, and the basenames of their outputs (e.g. the panel
+    ``fig20210113144259-left``). In the latter case, the whole module is
+    selected. Raises ``RuntimeError`` if some pattern matches nothing.
+    """
+    selected = set()
+    for pattern in patterns:
+        matches = {
+            name
+            for name in names
+            if fnmatch.fnmatchcase(name, pattern)
+            or any(
+                fnmatch.fnmatchcase(os.path.splitext(output)[0], pattern)
+                for output in build_manifest.outputs(name)
+            )
+        }
+        if not matches:
+            raise RuntimeError("no figure matches {}".format(pattern))
+        selected |= matches
+    return [name for name in names if name in selected]
+
+
+def stale_figures(names, build_manifest, force=False):
+    """Return the list of ``(name, reason)`` of the stale figure modules."""
+    stale = []
+    for name in names:
+        reason = "forced" if force else None
+        reason = reason or build_manifest.status(name, manifest.fingerprint(name))
+        if reason is not None:
+            stale.append((name, reason))
+    return stale
+
+
+def init_worker(stylesheet_filename, geometry_cache):
+    """Set up the state of a worker process (see ``build()``)."""
+    stylesheet.load(stylesheet_filename)
+    geometry.set_disk_cache(geometry_cache)
+
+
+def build_figures(names, label_jobs=None):
+    """Generate the figures of modules ``names``, in the current process."""
+    with labelling.batch(label_jobs), labelling.prefetch(label_jobs):
+        for name in names:
+            importlib.import_module(name).main()
+
+
+def build(names, jobs=None, label_jobs=None):
+    """Generate the figures of modules ``names``, in ``jobs`` processes.
+
+    Each worker process loads its own copy of the current stylesheet, and
+    compiles its own labels (the label index is locked while it is
+    updated). By default, there are as many processes as CPUs.
+    """
+    jobs = min(jobs or os.cpu_count() or 1, len(names))
+    if jobs <= 1:
+        build_figures(names, label_jobs)
+        return
+    if label_jobs is None:
+        label_jobs = max(1, stylesheet.label_jobs() // jobs)
+    initargs = (os.path.abspath(stylesheet.filename()), geometry.disk_cache())
+    with concurrent.futures.ProcessPoolExecutor(
+        jobs, initializer=init_worker, initargs=initargs
+    ) as pool:
+        futures = [pool.submit(build_figures, [name], label_jobs) for name in names]
+        for future in futures:
+            future.result()
+
+
+def update_manifest(build_manifest, names):
+    # To be called once the label index and the outputs are up to date
+    for name in names:
+        build_manifest.update(name, manifest.fingerprint(name), manifest.outputs(name))
+    build_manifest.flush()
+
+
+def reload_modules(changed):
+    """Reload the local modules in ``changed``, and those which import them.
+
+    Only modules that are already loaded are reloaded. Dependencies are
+    reloaded first, so that ``from module import name`` picks the new
+    objects. Returns the set of reloaded modules.
+    """
+    loaded = [
+        name
+        for name in sys.modules
+        if name != "__main__" and os.path.exists(manifest.module_path(name))
+    ]
+    dependencies = {name: set(manifest.dependencies(name)) for name in loaded}
+    affected = {name for name in loaded if dependencies[name] & changed}
+    reloaded = set()
+
+    def reload(name):
+        if name in reloaded:
+            return
+        reloaded.add(name)
+        for dependency in sorted(dependencies[name] & affected - {name}):
+            reload(dependency)
+        importlib.reload(sys.modules[name])
+
+    for name in sorted(affected):
+        reload(name)
+    return reloaded
+
+
+def watch(names, args):
+    """Regenerate the figures of modules ``names`` when their inputs change.
+
+    All figures are generated in this process, so that imported modules,
+    parsed labels, the label index and the evaluations of the shells
+    remain in memory from one build to the next. Changed modules are
+    reloaded (see ``reload_modules()``).
+    """
+
+    def snapshot():
+        filenames = {manifest.module_path(module) for module in modules}
+        filenames.add(stylesheet.filename())
+        mtimes = {}
+        for filename in filenames:
+            try:
+                mtimes[filename] = os.stat(filename).st_mtime_ns
+            except FileNotFoundError:
+                # File being saved
+                pass
+        return mtimes
+
+    dependencies = {name: set(manifest.dependencies(name)) for name in names}
+    modules = set().union(*dependencies.values())
+    mtimes = snapshot()
+    print("Watching {} figure(s) (Ctrl-C to stop)".format(len(names)))
+    while True:
+        time.sleep(WATCH_INTERVAL)
+        current = snapshot()
+        changed = {f for f, mtime in current.items() if mtimes.get(f) != mtime}
+        if not changed:
+            continue
+        mtimes = current
+
+        start = time.perf_counter()
+        filename = stylesheet.filename()
+        changed_modules = {
+            os.path.splitext(os.path.basename(f))[0] for f in changed - {filename}
+        }
+        try:
+            # Sources are parsed again, as imports may have changed
+            dependencies = {name: set(manifest.dependencies(name)) for name in names}
+            modules = set().union(*dependencies.values())
+            mtimes = {**snapshot(), **current}
+            if filename in changed:
+                affected = names
+            else:
+                affected = [
+                    name for name in names if dependencies[name] & changed_modules
+                ]
+            reloaded = reload_modules(changed_modules)
+            if filename in changed or "stylesheet" in reloaded:
+                # Reloading the stylesheet module restores the default stylesheet
+                stylesheet.load(filename)
+            configure(args)
+            build_figures(affected, args.label_jobs)
+            update_manifest(manifest.read_manifest(), affected)
+        except Exception:
+            traceback.print_exc()
+            continue
+        print(
+            "Generated {} in {:.2f} s".format(
+                ", ".join(affected), time.perf_counter() - start
+            )
+        )
+
+
+def configure(args):
+    if args.geometry_cache:
+        geometry.set_disk_cache(stylesheet.full_path("geometry-cache"))
+    else:
+        geometry.set_disk_cache(stylesheet.geometry_cache())
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate the figures.")
+    parser.add_argument(
+        "figures",
+        nargs="*",
+        metavar="FIGURE",
+        help="names or globs of the figures to generate (default: all)",
+    )
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=None,
+        help="number of figures generated concurrently (defaults to the CPU count)",
+    )
+    parser.add_argument(
+        "--label-jobs",
+        type=int,
+        default=None,
+        help="maximum number of concurrent XeLaTeX runs (overrides the stylesheet)",
+    )
+    parser.add_argument(
+        "--geometry-cache",
+        action="store_true",
+        help="store sampled geometry in the output directory (see the stylesheet)",
+    )
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help="regenerate all figures, even if their inputs did not change",
+    )
+    parser.add_argument(
+        "--dry-run",
+        action="store_true",
+        help="only report the figures which would be generated",
+    )
+    parser.add_argument(
+        "--watch",
+        action="store_true",
+        help="keep running, and regenerate the figures when their sources change",
+    )
+    args = parser.parse_args(argv)
+
+    build_manifest = manifest.read_manifest()
+    names = discover_figures()
+    if args.figures:
+        try:
+            names = select_figures(args.figures, names, build_manifest)
+        except RuntimeError as e:
+            parser.error(str(e))
+    stale = stale_figures(names, build_manifest, args.force)
+    for name, reason in stale:
+        print("{}: {}".format(name, reason))
+    print(
+        "{} stale figure(s), {} up to date".format(len(stale), len(names) - len(stale))
+    )
+    if args.dry_run or not (stale or args.watch):
+        return
+
+    configure(args)
+    stale = [name for name, _ in stale]
+    if stale:
+        if args.watch:
+            # Warm up this process for the next builds
+            build_figures(stale, args.label_jobs)
+        else:
+            build(stale, args.jobs, args.label_jobs)
+        update_manifest(build_manifest, stale)
+    if args.watch:
+        try:
+            watch(names, args)
+        except KeyboardInterrupt:
+            pass
+
 
 if __name__ == "__main__":
-    fig20210105175723.main()
-    fig20210113144259.main()
-    fig20210115155239.main()
+    main()
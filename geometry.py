@@ -1,34 +1,291 @@
-"""Helper function for the generation of 3D curves and surfaces"""
+"""Helper function for the generation of 3D curves and surfaces
+
+All surfaces are vectorized: they accept scalars or arrays (of any
+broadcastable shapes) ``u`` and ``v``, and return an array of shape
+``(..., 3)``. Likewise, curves return an array of shape ``(..., 2)``.
+This allows whole sets of points (e.g. meshgrids) to be evaluated in one
+NumPy pass.
+
+Surfaces may provide their partial derivatives as (vectorized) methods
+``diff_u(u, v)`` and ``diff_v(u, v)``. Otherwise, ``diff_u()`` and
+``diff_v()`` fall back to central finite differences.
+
+``Shell.evaluate()`` computes the mid-surface, its normal and both offset
+surfaces in one pass. Results are memoized (keyed by the sample arrays),
+so that drawing the inner and outer faces of the same samples does not
+evaluate the mid-surface and its normal twice.
+
+Optionally (see ``set_disk_cache()``), evaluations of at least
+``DISK_CACHE_MIN_SAMPLES`` samples are also stored as ``.npy`` files,
+which are memory-mapped on later runs (smaller evaluations are cheaper to
+compute than to load). Cache entries are named after a ``fingerprint()``
+of the shell (including the code of its surfaces and thickness functions)
+and of the sample arrays. The least recently used entries are deleted
+when the cache exceeds ``DISK_CACHE_MAX_SIZE``.
+
+For shells that are not plates, ``tessellate()`` returns a quadrilateral
+mesh of their boundary, which ``pycairo_utils.draw_mesh()`` renders with
+hidden faces and lines removed.
+"""
+import functools
+import hashlib
+import os
+import tempfile
+import types
+
+from collections import OrderedDict, namedtuple
+
 import numpy as np
 
 COS_30_DEG = 0.5 * np.sqrt(3)
 SIN_30_DEG = 0.5
 
-
-def project(x, y, z):
-    return COS_30_DEG * (y - x), z - SIN_30_DEG * (x + y)
+SHELL_CACHE_SIZE = 256
+
+# Minimum number of samples of the evaluations stored on disk
+DISK_CACHE_MIN_SAMPLES = 1024
+
+# Maximum size of the on-disk cache, in bytes
+DISK_CACHE_MAX_SIZE = 64 * 1024 * 1024
+
+__disk_cache = None
+
+
+def set_disk_cache(directory):
+    """Store shell evaluations in ``directory`` (``None`` disables the cache).
+
+    The cache is pruned to ``DISK_CACHE_MAX_SIZE``.
+    """
+    global __disk_cache
+    if directory is not None:
+        os.makedirs(directory, exist_ok=True)
+        prune_disk_cache(directory, DISK_CACHE_MAX_SIZE)
+    __disk_cache = directory
+
+
+def prune_disk_cache(directory, max_size):
+    """Delete the least recently used entries of the cache in ``directory``.
+
+    Entries are deleted until the cache takes at most ``max_size`` bytes.
+    """
+    entries = []
+    for entry in os.scandir(directory):
+        if entry.name.endswith(".npy"):
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+    size = sum(entry[1] for entry in entries)
+    for _, entry_size, path in sorted(entries):
+        if size <= max_size:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            # Removed by a concurrent process
+            pass
+        size -= entry_size
+
+
+def disk_cache():
+    return __disk_cache
+
+
+def load_cached(key):
+    """Return the (memory-mapped) array stored under ``key``, or ``None``."""
+    if __disk_cache is None:
+        return None
+    filename = os.path.join(__disk_cache, key + ".npy")
+    try:
+        array = np.load(filename, mmap_mode="r")
+        # The modification time is the time of last use (see prune_disk_cache())
+        os.utime(filename)
+    except (OSError, ValueError):
+        return None
+    return array
+
+
+def save_cached(key, array):
+    if __disk_cache is None:
+        return
+    fd, tmp = tempfile.mkstemp(dir=__disk_cache, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            np.save(f, array)
+        os.replace(tmp, os.path.join(__disk_cache, key + ".npy"))
+    except BaseException:
+        os.remove(tmp)
+        raise
+
+
+def fingerprint(*objs):
+    """Return a digest of ``objs`` which is stable across runs.
+
+    Functions are identified by their bytecode, constants, defaults,
+    closures and the global variables they refer to. Other objects are
+    identified by their type (including the code of its methods) and
+    attributes.
+    """
+    h = hashlib.sha1()
+    __update_fingerprint(h, objs, {})
+    return h.hexdigest()
+
+
+def __update_fingerprint(h, obj, seen):
+    if obj is None or isinstance(obj, (bool, int, float, complex, str, bytes)):
+        h.update(repr(obj).encode())
+        return
+    if isinstance(obj, np.generic):
+        h.update(repr(obj.item()).encode())
+        return
+    if isinstance(obj, np.ndarray):
+        h.update("ndarray{}{}".format(obj.dtype.str, obj.shape).encode())
+        h.update(np.ascontiguousarray(obj).tobytes())
+        return
+    if isinstance(obj, types.ModuleType):
+        h.update("module {}".format(obj.__name__).encode())
+        return
+    if id(obj) in seen:
+        h.update(b"<cycle>")
+        return
+    # Keep a reference, so that the id of obj is not reused
+    seen[id(obj)] = obj
+
+    def update(x):
+        __update_fingerprint(h, x, seen)
+
+    h.update(type(obj).__qualname__.encode())
+    if isinstance(obj, (tuple, list)):
+        h.update(str(len(obj)).encode())
+        for x in obj:
+            update(x)
+    elif isinstance(obj, dict):
+        update(sorted(obj.items(), key=lambda item: repr(item[0])))
+    elif isinstance(obj, types.CodeType):
+        update((obj.co_code, obj.co_consts, obj.co_names))
+    elif isinstance(obj, types.FunctionType):
+        code = obj.__code__
+        cells = tuple(c.cell_contents for c in obj.__closure__ or ())
+        names = [name for name in code.co_names if name in obj.__globals__]
+        update((code, obj.__defaults__, cells))
+        update({name: obj.__globals__[name] for name in names})
+    elif isinstance(obj, types.MethodType):
+        update((obj.__func__, obj.__self__))
+    elif isinstance(obj, type):
+        h.update("{}.{}".format(obj.__module__, obj.__qualname__).encode())
+        update({k: v for k, v in vars(obj).items() if callable(v)})
+    elif callable(obj) and not hasattr(obj, "__dict__"):
+        # Built-in functions, ufuncs...
+        h.update(repr(obj).encode())
+    else:
+        update((type(obj), getattr(obj, "__dict__", {})))
+
+
+def as_points(*coords):
+    """Stack (broadcast) coordinates into an array of shape ``(..., dim)``."""
+    return np.stack(np.broadcast_arrays(*coords), axis=-1)
+
+
+def _normalize(x):
+    x = np.asarray(x, dtype=float)
+    return x / np.linalg.norm(x)
+
+
+class Projection:
+    """Projection of 3D points onto the plane of the figure.
+
+    The projection is defined by a matrix acting on homogeneous coordinates:
+    either a 2×4 matrix (parallel projections), or a 3×4 matrix (perspective
+    projections), in which case the first two coordinates are divided by
+    the third one.
+    """
+
+    def __init__(self, matrix):
+        self.matrix = np.asarray(matrix, dtype=float)
+        if self.matrix.shape not in ((2, 4), (3, 4)):
+            raise ValueError("invalid projection matrix: {}".format(self.matrix))
+
+    @classmethod
+    def oblique(cls, e_x, e_y, e_z):
+        """Parallel projection mapping the unit vectors to ``e_x, e_y, e_z``."""
+        return cls(np.column_stack([e_x, e_y, e_z, (0.0, 0.0)]))
+
+    @staticmethod
+    def __camera(direction, up):
+        direction = _normalize(direction)
+        right = _normalize(np.cross(direction, up))
+        return right, np.cross(right, direction), direction
+
+    @classmethod
+    def orthographic(cls, direction, up=(0.0, 0.0, 1.0), scale=1.0):
+        """Orthographic projection, looking along ``direction``."""
+        right, up, _ = cls.__camera(direction, up)
+        return cls(scale * np.column_stack([np.stack([right, up]), (0.0, 0.0)]))
+
+    @classmethod
+    def perspective(cls, eye, target, up=(0.0, 0.0, 1.0), focal_length=1.0):
+        """Perspective projection from ``eye``, looking at ``target``."""
+        eye = np.asarray(eye, dtype=float)
+        right, up, direction = cls.__camera(np.subtract(target, eye), up)
+        rows = np.stack([focal_length * right, focal_length * up, direction])
+        return cls(np.column_stack([rows, -rows @ eye]))
+
+    def points(self, points):
+        """Project an array of points of shape ``(..., 3)`` to shape ``(..., 2)``."""
+        points = np.asarray(points, dtype=float)
+        xy = points @ self.matrix[:, :3].T + self.matrix[:, 3]
+        if len(self.matrix) == 3:
+            xy = xy[..., :2] / xy[..., 2:]
+        return xy
+
+    def __call__(self, x, y, z):
+        x, y = np.moveaxis(self.points(as_points(x, y, z)), -1, 0)
+        return x, y
+
+    def depth(self, points):
+        """Return the depth of ``points`` (larger values are farther)."""
+        points = np.asarray(points, dtype=float)
+        if len(self.matrix) == 3:
+            return points @ self.matrix[2, :3] + self.matrix[2, 3]
+        # The image of a face is counterclockwise iff its normal points
+        # towards the viewer, which is therefore the following direction
+        return -points @ np.cross(self.matrix[0, :3], self.matrix[1, :3])
+
+
+# Default projection: the x, y and z axes are drawn with unit length, at
+# 210°, 330° and 90°
+project = Projection.oblique(
+    (-COS_30_DEG, -SIN_30_DEG), (COS_30_DEG, -SIN_30_DEG), (0.0, 1.0)
+)
+project_points = project.points
 
 
 def diff_u(f, h=1e-4):
-    if hasattr(f, "__diff_u"):
-        return f.__diff_u
+    """Return the partial derivative of ``f`` with respect to ``u``.
+
+    The analytic derivative ``f.diff_u`` is used if it exists. Otherwise,
+    the derivative is approximated by central differences (step ``h``).
+    """
+    if hasattr(f, "diff_u"):
+        return f.diff_u
 
     def f_u(u, v):
-        x1, y1, z1 = f(u, v)
-        x2, y2, z2 = f(u + h, v)
-        return (x2 - x1) / h, (y2 - y1) / h, (z2 - z1) / h
+        return (f(u + h, v) - f(u - h, v)) / (2 * h)
 
     return f_u
 
 
 def diff_v(f, h=1e-4):
-    if hasattr(f, "__diff_v"):
-        return f.__diff_v
+    """Return the partial derivative of ``f`` with respect to ``v``.
+
+    See ``diff_u()``.
+    """
+    if hasattr(f, "diff_v"):
+        return f.diff_v
 
     def f_v(u, v):
-        x1, y1, z1 = f(u, v)
-        x2, y2, z2 = f(u, v + h)
-        return (x2 - x1) / h, (y2 - y1) / h, (z2 - z1) / h
+        return (f(u, v + h) - f(u, v - h)) / (2 * h)
 
     return f_v
 
@@ -50,18 +307,91 @@ def surface_normal(f, h=1e-4):
 def shift_surface(f, d, n=None):
     if n is None:
         n = surface_normal(f)
-    return lambda u, v: f(u, v) + d(u, v) * n(u, v)
+    return lambda u, v: f(u, v) + np.asarray(d(u, v))[..., np.newaxis] * n(u, v)
+
+
+def chord_error(p, a, b):
+    """Return the distance from points ``p`` to the segments ``[a, b]``."""
+    ab = b - a
+    ab_ab = np.sum(ab * ab, axis=-1)
+    s = np.sum((p - a) * ab, axis=-1) / np.where(ab_ab > 0.0, ab_ab, 1.0)
+    s = np.clip(s, 0.0, 1.0)[..., np.newaxis]
+    return np.linalg.norm(a + s * ab - p, axis=-1)
+
+
+def simplify(points, tol):
+    """Simplify a polyline with the Douglas–Peucker algorithm.
+
+    The returned points are a subset of ``points`` (including both ends),
+    such that all discarded points lie within ``tol`` of the simplified
+    polyline.
+    """
+    points = np.asarray(points, dtype=float)
+    if len(points) < 3 or tol <= 0.0:
+        return points
+    keep = np.zeros(len(points), dtype=bool)
+    keep[[0, -1]] = True
+    intervals = [(0, len(points) - 1)]
+    while intervals:
+        i, j = intervals.pop()
+        if j - i < 2:
+            continue
+        error = chord_error(points[i + 1 : j], points[i], points[j])
+        k = np.argmax(error)
+        if error[k] > tol:
+            k += i + 1
+            keep[k] = True
+            intervals += [(i, k), (k, j)]
+    return points[keep]
+
+
+def adaptive_sample(curve, breakpoints, tol, num=4, max_depth=16):
+    """Return the parameters of a polyline approximation of ``curve``.
+
+    ``curve(t)`` must return an array of shape ``(len(t), ..., dim)``, so
+    that several curves sharing the same parameter can be sampled at once.
+
+    The returned (sorted) parameters include ``breakpoints``. Each interval
+    between successive breakpoints is first divided into ``num`` equal
+    parts, which are then bisected until the distance between the midpoint
+    of the curve and the corresponding chord is smaller than ``tol``.
+    """
+    breakpoints = np.unique(np.asarray(breakpoints, dtype=float))
+    s = np.linspace(0.0, 1.0, num=num, endpoint=False)
+    t = np.append(
+        (breakpoints[:-1, None] + np.outer(np.diff(breakpoints), s)).ravel(),
+        breakpoints[-1],
+    )
+    points = np.asarray(curve(t))
+    active = np.arange(t.size - 1)
+    for _ in range(max_depth):
+        if active.size == 0:
+            break
+        t_mid = 0.5 * (t[active] + t[active + 1])
+        p_mid = np.asarray(curve(t_mid))
+        error = chord_error(p_mid, points[active], points[active + 1])
+        refine = error.reshape(active.size, -1).max(axis=1) > tol
+        i = active[refine] + 1
+        t = np.insert(t, i, t_mid[refine])
+        points = np.insert(points, i, p_mid[refine], axis=0)
+        # Index of the inserted points in the new arrays
+        j = i + np.arange(i.size)
+        active = np.concatenate([j - 1, j])
+        active.sort()
+    return t
 
 
 class Plane:
     def __call__(self, u, v):
-        return u, v, 0.0
+        return as_points(u, v, 0.0)
 
-    def __diff_u(self, uv):
-        return 1.0, 0.0, 0.0
+    def diff_u(self, u, v):
+        u, v = np.broadcast_arrays(u, v)
+        return as_points(1.0, 0.0, np.zeros_like(u, dtype=float))
 
-    def __diff_v(self, uv):
-        return 0.0, 1.0, 0.0
+    def diff_v(self, u, v):
+        u, v = np.broadcast_arrays(u, v)
+        return as_points(0.0, 1.0, np.zeros_like(u, dtype=float))
 
 
 class HyperbolicParaboloid:
@@ -70,13 +400,15 @@ class HyperbolicParaboloid:
         self.b = b
 
     def __call__(self, u, v):
-        return u, v, (u / self.a) ** 2 - (v / self.b) ** 2
+        return as_points(u, v, (u / self.a) ** 2 - (v / self.b) ** 2)
 
-    def __diff_u(self, u, v):
-        return 1.0, 0.0, 2 * u / self.a
+    def diff_u(self, u, v):
+        u, v = np.broadcast_arrays(u, v)
+        return as_points(1.0, 0.0, 2 * u / self.a**2)
 
-    def __diff_v(self, u, v):
-        return 0.0, 1.0, 2 * v / self.b
+    def diff_v(self, u, v):
+        u, v = np.broadcast_arrays(u, v)
+        return as_points(0.0, 1.0, -2 * v / self.b**2)
 
 
 class Ellipse:
@@ -85,22 +417,204 @@ class Ellipse:
         self.b = b
 
     def __call__(self, t):
-        return self.a * np.cos(t), self.b * np.sin(t)
+        return as_points(self.a * np.cos(t), self.b * np.sin(t))
+
+
+ShellPoints = namedtuple("ShellPoints", "mid normal inf sup")
 
 
 class Shell:
-    def __init__(self, f_mid, n_mid, d_inf, d_sup):
+    def __init__(self, f_mid, n_mid, d_inf, d_sup, cache_size=SHELL_CACHE_SIZE):
         self.f_mid = f_mid
         self.n_mid = n_mid
         self.d_inf = d_inf
         self.d_sup = d_sup
-
-        self.n_mid = surface_normal(f_mid)
-        self.f_inf = shift_surface(f_mid, d_inf, n_mid)
-        self.f_sup = shift_surface(f_mid, d_sup, n_mid)
-
-
+        self.cache_size = cache_size
+        self.__cache = OrderedDict()
+        self.__fingerprint = None
+
+    def evaluate(self, u, v):
+        """Return the ``ShellPoints`` at ``(u, v)``.
+
+        The returned arrays are shared with the cache, and read-only.
+        """
+        u, v = np.broadcast_arrays(np.asarray(u, float), np.asarray(v, float))
+        key = (u.shape, u.tobytes(), v.tobytes())
+        points = self.__cache.get(key)
+        if points is not None:
+            self.__cache.move_to_end(key)
+            return points
+
+        points = self.__evaluate_cached(u, v)
+
+        if self.cache_size > 0:
+            self.__cache[key] = points
+            if len(self.__cache) > self.cache_size:
+                self.__cache.popitem(last=False)
+        return points
+
+    def __evaluate(self, u, v):
+        mid = self.f_mid(u, v)
+        normal = self.n_mid(u, v)
+        d_inf = np.asarray(self.d_inf(u, v))[..., np.newaxis]
+        d_sup = np.asarray(self.d_sup(u, v))[..., np.newaxis]
+        return np.stack([mid, normal, mid + d_inf * normal, mid + d_sup * normal])
+
+    def __evaluate_cached(self, u, v):
+        key = None
+        if disk_cache() is not None and u.size >= DISK_CACHE_MIN_SAMPLES:
+            if self.__fingerprint is None:
+                self.__fingerprint = fingerprint(
+                    self.f_mid, self.n_mid, self.d_inf, self.d_sup
+                )
+            key = "shell-" + fingerprint(self.__fingerprint, u, v)
+            points = load_cached(key)
+            if points is not None and points.shape[1:-1] == u.shape:
+                return ShellPoints(*points)
+
+        points = self.__evaluate(u, v)
+        if key is not None:
+            save_cached(key, points)
+        points.flags.writeable = False
+        return ShellPoints(*points)
+
+    def f_inf(self, u, v):
+        return self.evaluate(u, v).inf
+
+    def f_sup(self, u, v):
+        return self.evaluate(u, v).sup
+
+    def clear_cache(self):
+        self.__cache.clear()
+
+
+def sample_shell(shell, breakpoints, fixed, tol, along="u", projection=project):
+    """Adaptively sample ``u`` (``along="u"``) or ``v`` for ``shell``.
+
+    The mid, inner and outer iso-lines ``v = fixed`` (resp. ``u = fixed``),
+    projected by ``projection``, are approximated within ``tol``. See
+    ``adaptive_sample()``.
+    """
+    fixed = np.asarray(fixed, dtype=float)
+
+    def curve(t):
+        t = t[:, np.newaxis]
+        points = shell.evaluate(t, fixed) if along == "u" else shell.evaluate(fixed, t)
+        points = np.concatenate([points.mid, points.inf, points.sup], axis=1)
+        return projection.points(points)
+
+    return adaptive_sample(curve, breakpoints, tol)
+
+
+Mesh = namedtuple("Mesh", "vertices faces groups edges")
+
+# Groups of the faces of a tessellated shell
+SUP, INF, U_MIN, U_MAX, V_MIN, V_MAX = range(6)
+
+
+def tessellate(shell, u, v, iso_u=(), iso_v=()):
+    """Tessellate the boundary of the part of ``shell`` over ``u × v``.
+
+    Return a ``Mesh``, where
+
+    - ``vertices`` is an array of shape ``(V, 3)``,
+    - ``faces`` is an array of shape ``(F, 4)`` of vertex indices; faces
+      are oriented counterclockwise, seen from outside (``d_inf < d_sup``),
+    - ``groups`` is an array of shape ``(F,)``: the face of the shell each
+      face belongs to (``SUP``, ``INF``, ``U_MIN``...),
+    - ``edges`` is a boolean array of shape ``(F, 4)``: whether the edge
+      from vertex ``k`` to vertex ``k + 1`` of each face lies on an edge of
+      the shell, or on one of the iso-lines ``u = iso_u`` or ``v = iso_v``
+      (which must be values of ``u`` and ``v``).
+
+    Raises ``ValueError`` if the faces are not oriented outwards (see
+    ``signed_volume()``), which hidden surface removal relies on.
+    """
+    u = np.asarray(u, dtype=float)
+    v = np.asarray(v, dtype=float)
+    nu, nv = len(u), len(v)
+    points = shell.evaluate(u[:, np.newaxis], v)
+    vertices = np.concatenate([points.sup.reshape(-1, 3), points.inf.reshape(-1, 3)])
+    sup = np.arange(nu * nv, dtype=np.int32).reshape(nu, nv)
+    offset = nu * nv
+    inf = sup + offset
+
+    line_u = np.isin(u, iso_u)
+    line_u[[0, -1]] = True
+    line_v = np.isin(v, iso_v)
+    line_v[[0, -1]] = True
+
+    i, j = np.meshgrid(np.arange(nu - 1), np.arange(nv - 1), indexing="ij")
+    i, j = i.ravel(), j.ravel()
+    faces = [
+        np.stack([sup[i, j], sup[i + 1, j], sup[i + 1, j + 1], sup[i, j + 1]], -1),
+        np.stack([inf[i, j], inf[i, j + 1], inf[i + 1, j + 1], inf[i + 1, j]], -1),
+    ]
+    edges = [
+        np.stack([line_v[j], line_u[i + 1], line_v[j + 1], line_u[i]], -1),
+        np.stack([line_u[i], line_v[j + 1], line_u[i + 1], line_v[j]], -1),
+    ]
+    groups = [np.full(i.size, SUP), np.full(i.size, INF)]
+
+    # Lateral faces, between the boundary line (of the upper face) and the
+    # corresponding line of the lower face
+    for line, group in [
+        (sup[0, ::-1], U_MIN),
+        (sup[-1, :], U_MAX),
+        (sup[:, 0], V_MIN),
+        (sup[::-1, -1], V_MAX),
+    ]:
+        k = np.arange(len(line) - 1)
+        faces.append(
+            np.stack([line[:-1] + offset, line[1:] + offset, line[1:], line[:-1]], -1)
+        )
+        edges.append(np.stack([k >= 0, k == k[-1], k >= 0, k == 0], -1))
+        groups.append(np.full(k.size, group))
+
+    mesh = Mesh(
+        vertices, np.concatenate(faces), np.concatenate(groups), np.concatenate(edges)
+    )
+    if not signed_volume(mesh) > 0.0:
+        raise ValueError("faces are not oriented outwards (d_inf >= d_sup?)")
+    return mesh
+
+
+def face_neighbors(mesh):
+    """Return the face across each edge of each face of ``mesh``.
+
+    Returns an array of shape ``(F, 4)``: the neighbor of face ``f``
+    across the edge from vertex ``k`` to vertex ``k + 1`` is
+    ``neighbors[f, k]`` (``-1`` on the border of an open mesh).
+    """
+    a = mesh.faces.astype(np.int64)
+    b = np.roll(a, -1, axis=1)
+    keys = (np.minimum(a, b) * len(mesh.vertices) + np.maximum(a, b)).ravel()
+    order = np.argsort(keys, kind="stable")
+    shared = keys[order[1:]] == keys[order[:-1]]
+    i, j = order[:-1][shared], order[1:][shared]
+    neighbors = np.full(keys.size, -1)
+    neighbors[i] = j // 4
+    neighbors[j] = i // 4
+    return neighbors.reshape(a.shape)
+
+
+def signed_volume(mesh):
+    """Return the volume enclosed by the closed ``mesh``.
+
+    The volume is negative if the faces are oriented inwards.
+    """
+    a, b, c, d = np.moveaxis(mesh.vertices[mesh.faces], 1, 0)
+    return (np.sum(a * np.cross(b, c)) + np.sum(a * np.cross(c, d))) / 6.0
+
+
+@functools.lru_cache(maxsize=None)
 def default_shell(plate=True, constant_thickness=True):
+    """Return the shell used in the figures.
+
+    The same instance is returned for the same arguments, so that the
+    evaluations it caches are shared by all figures (and all builds in a
+    long-running process, see ``figures.py --watch``).
+    """
     f_mid = Plane() if plate else HyperbolicParaboloid(11.0, 8.0)
     n_mid = surface_normal(f_mid)
 
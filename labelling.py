@@ -3,41 +3,149 @@ This module is used to generate and retrieve labels for the figures.
 
 Each label is a standalone XeLaTeX file, named
 
+    label-<hash>.tex
+
+where the hash is computed from the contents of the label and the
+preamble (content-addressed store). Labels may optionally be sharded
+in subdirectories (see ``SHARD_LENGTH``). Older labels, named
+
     label<timestamp>.tex
 
+are still recognized.
+
 XeLaTeX is run automatically to generate the PDF. Then PyPDF2 is used
 to insert the label at the desired place.
 
+Missing labels are compiled in batches: all labels are typeset as the
+pages of one multi-page standalone document, which is then split into
+per-label PDFs. This way, the startup cost of XeLaTeX (engine, preamble
+and fonts) is paid once per batch rather than once per label. Several
+batches are compiled concurrently (see the "label jobs" entry of the
+stylesheet), each in its own working directory.
+
+The preamble is dumped once into a precompiled format file,
+
+    preamble-<hash>.fmt
+
+from which all subsequent compilations start. The hash depends on the
+preamble and on the version of XeLaTeX, so that the format is rebuilt
+automatically when either of them changes. The format is built with
+the mylatexformat package; if this fails, labels are compiled without
+format. The failure is recorded in
+
+    preamble-<hash>.failed
+
+so that the build is not attempted again (by any process) until the
+preamble or XeLaTeX changes. Note that fonts loaded by XeTeX cannot be
+dumped: the font setup is therefore placed after the end of the dumped
+part.
+
+With PyPDF2 (the default), each label is inserted as a form XObject,
+which is shared by all occurrences of the label in the figure. Identical
+resources of the labels (in particular, fonts of labels that were
+compiled in the same batch) are embedded only once, and the inserted
+content streams are compressed.
+
+Alternatively (when the "label overlay" entry of the stylesheet is
+"tex" rather than "merge"), the labels of a figure are not merged one by
+one with PyPDF2. Instead, one XeLaTeX document is generated per figure:
+it includes the bare figure, and typesets all labels at their position.
+The figure is then composed in one step, and fonts are embedded once.
+
+Within a ``prefetch()`` block, if the "prefetch labels" entry of the
+stylesheet is true, labels are compiled in the background as soon as they
+are created, while the figure is still being drawn. Each background run
+compiles the labels queued so far (after ``PREFETCH_DELAY``), so that
+labels are spread over more XeLaTeX runs than without prefetching, and
+fewer fonts are shared: prefetching trades batching for latency.
+
+Within a ``batch()`` block, the insertion of labels is deferred until
+the end of the block, so that all the labels of a complete build are
+compiled together.
+
 The generated labels are indexed in a JSON file called labels.json.
 The syntax is
 
     {
-        "XeLaTeX contents": basename
+        "version": 3,
+        "labels": {
+            "XeLaTeX contents": {
+                "basename": basename,
+                "size": [width, height],
+                "baseline": baseline
+            }
+        },
+        "figures": {
+            "figure basename": [label basenames]
+        }
     }
 
+The size of the label and the height of its baseline (both measured
+from the lower-left corner, in PDF points) are recorded when the label
+is compiled, so that labels can be laid out without opening their PDF.
+
+The "figures" entry records which labels are used by each figure. The
+labels that are not used by any figure can be deleted with
+
+    python labelling.py gc [--dry-run]
+
+which refuses to run as long as some figure of the manifest has not
+recorded the labels it uses.
+
+(Former versions of the index, where the entries of "labels" are mere
+basenames, or the index is a plain ``{"XeLaTeX contents": basename}``
+mapping, are still read.)
+
 When a non-existing label is required, it is first automatically
 generated.
 
-Note that importing this module actually does pre-generate some labels
-(if necessary).
+The index is loaded once per process (see ``LabelIndex``). New entries
+are written back at the end of a ``batch()`` block (or when the process
+exits).
+
+Importing this module has no side effect: the index is read, and labels
+are compiled, on demand. PyPDF2 is only imported (by the functions which
+use it) when labels are compiled or merged.
 """
-import datetime
+import argparse
+import atexit
+import concurrent.futures
+import contextlib
+import errno
+import functools
+import glob
+import hashlib
+import io
 import json
+import os
 import os.path
-import pathlib
+import re
+import shutil
 import subprocess
+import tempfile
+import threading
+import time
+
+from itertools import chain
 
-import PyPDF2
+try:
+    import fcntl
+except ImportError:
+    # Windows
+    import msvcrt
+
+    fcntl = None
 
 import stylesheet
 
 LATEX_CODE = """
-\\documentclass[12pt, border=0mm, crop=true]{{standalone}}
+\\documentclass[12pt, border=0mm, crop=true, multi=true]{{standalone}}
 \\usepackage{{amsfonts}}
 \\usepackage{{amsmath}}
 \\usepackage{{amssymb}}
 \\usepackage{{unicode-math}}
 \\usepackage{{xcolor}}
+\\csname endofdump\\endcsname
 \\setmainfont{{XITS}}
 \\setmathfont{{XITS Math}}
 \\AtBeginDocument{{
@@ -45,40 +153,644 @@ LATEX_CODE = """
   \\newcommand{{\\tens}}[1]{{\\symbfsf{{#1}}}}
   \\renewcommand{{\\vec}}[1]{{\\symbf{{#1}}}}}}
 \\begin{{document}}
-    {}
+{}
 \\end{{document}}
 """
 
+# The depth of the label is written to the log, to locate the baseline
+LATEX_PAGE = """\\begin{{standalone}}
+    \\sbox0{{{}}}\\typeout{{labeldepth:\\the\\dp0}}\\usebox0
+\\end{{standalone}}"""
+
+LABEL_DEPTH_PATTERN = re.compile(r"labeldepth:([-\d.]+)pt")
+
+# Single page document made of the bare figure (box 1) and the labels
+LATEX_OVERLAY = """\\def\\labelat#1#2#3#4#5{{%
+  \\sbox0{{#5}}%
+  \\smash{{\\rlap{{\\kern\\dimexpr#1-#3\\wd0\\relax
+    \\raise\\dimexpr#2-#4\\ht0-#4\\dp0+\\dp0\\relax\\box0}}}}}}
+\\begin{{standalone}}
+  \\sbox1{{\\XeTeXpdffile "{}" \\relax}}%
+  \\hbox to \\wd1{{\\rlap{{\\usebox1}}%
+{}
+  \\hss}}
+\\end{{standalone}}"""
+
+LATEX_OVERLAY_LABEL = "    \\labelat{{{:.4f}bp}}{{{}}}{{{:.4f}}}{{{:.4f}}}{{{}}}%"
+
+OVERLAY_BASENAME = "overlay"
+
+# Maximum number of parsed label pages kept in memory
+LABEL_CACHE_SIZE = 256
+
 XELATEX_COMMAND = "xelatex"
 
+# Time during which a background run waits for more labels, in seconds
+PREFETCH_DELAY = 0.1
+
+# Maximum duration of one XeLaTeX run, in seconds
+XELATEX_TIMEOUT = 120
+
 INDEX_FILENAME = "labels.json"
 
+BATCH_BASENAME = "labels-batch"
+
+FORMAT_BASENAME = "preamble"
+
+# Number of leading hex digits of the hash used as the name of the
+# subdirectory where labels are stored (0: no sharding)
+SHARD_LENGTH = 0
+
+# Stem of the label files (relative to their directory)
+LABEL_PATTERN = re.compile(r"label(\d{14}(-\d+)?|-[0-9a-f]+)")
+
+LABEL_EXTENSIONS = (".tex", ".pdf", ".aux", ".log")
+
+# Name of the precompiled format (None if it could not be built), by
+# output directory
+__formats = {}
+__format_lock = threading.Lock()
+
+# Label indices, by full path of the index file
+__indices = {}
+
+# List of (basename, labels) pairs whose insertion is deferred
+__pending = None
+
+# Background compiler of the labels (see prefetch())
+__prefetcher = None
+
+
+class LabelIndex:
+    """In-memory copy of the label index.
+
+    The index file is loaded once, and reloaded only when its
+    modification time changes (to catch outside changes). New entries
+    are kept in memory until ``flush()`` is called; they are then merged
+    with the current contents of the file, which is replaced atomically.
+    """
 
-def write_index(index):
-    filename = stylesheet.full_path(INDEX_FILENAME)
-    with open(filename, "w") as f:
-        json.dump(index, f)
+    def __init__(self, filename):
+        self.filename = filename
+        self._labels = {}
+        self._figures = {}
+        self._new = {}
+        self._new_figures = {}
+        self._removed = set()
+        self._mtime = None
+        self._lock = threading.RLock()
+
+    def _stat(self):
+        try:
+            return os.stat(self.filename).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def _refresh(self):
+        with self._lock:
+            self._reload()
+
+    def _reload(self):
+        mtime = self._stat()
+        if mtime == self._mtime:
+            return
+        labels, figures = {}, {}
+        if mtime is not None:
+            with open(self.filename, "r") as f:
+                data = json.load(f)
+            if data.get("version") in (2, 3):
+                labels, figures = data["labels"], data["figures"]
+            else:
+                labels = data
+            labels = {
+                contents: entry if isinstance(entry, dict) else {"basename": entry}
+                for contents, entry in labels.items()
+            }
+        labels.update(self._new)
+        figures.update(self._new_figures)
+        for contents in self._removed:
+            labels.pop(contents, None)
+        self._labels = labels
+        self._figures = figures
+        self._mtime = mtime
+
+    def __contains__(self, contents):
+        self._refresh()
+        return contents in self._labels
+
+    def __getitem__(self, contents):
+        self._refresh()
+        return self._labels[contents]["basename"]
+
+    def __setitem__(self, contents, basename):
+        self.add(contents, basename)
+
+    def add(self, contents, basename, size=None, baseline=None):
+        entry = {"basename": basename}
+        if size is not None:
+            entry["size"] = list(size)
+        if baseline is not None:
+            entry["baseline"] = baseline
+        with self._lock:
+            self._reload()
+            self._new[contents] = entry
+            self._labels[contents] = entry
+
+    def entry(self, contents):
+        """Return the entry of the label (basename, and possibly geometry)."""
+        self._refresh()
+        return self._labels[contents]
+
+    def set_references(self, figure, basenames):
+        """Record the basenames of the labels used by ``figure``."""
+        basenames = sorted(set(basenames))
+        with self._lock:
+            self._reload()
+            if self._figures.get(figure) != basenames:
+                self._new_figures[figure] = basenames
+                self._figures[figure] = basenames
+
+    def references(self, figure=None):
+        """Return the basenames of the labels used by ``figure``.
+
+        If ``figure`` is ``None``, return the labels used by any figure.
+        """
+        self._refresh()
+        if figure is not None:
+            return set(self._figures.get(figure, ()))
+        return set(chain.from_iterable(self._figures.values()))
+
+    def figures(self):
+        self._refresh()
+        return list(self._figures)
+
+    def prune(self, basenames):
+        """Remove all entries whose basename is not in ``basenames``."""
+        with self._lock:
+            self._reload()
+            for contents, entry in list(self._labels.items()):
+                if entry["basename"] not in basenames:
+                    self._removed.add(contents)
+                    self._new.pop(contents, None)
+                    del self._labels[contents]
+
+    def flush(self):
+        """Merge the new entries with the file.
+
+        The file is locked meanwhile, so that concurrent processes do not
+        lose each other's entries.
+        """
+        with self._lock:
+            if not (self._new or self._new_figures or self._removed):
+                return
+            with file_lock(self.filename):
+                self._flush()
+
+    def _flush(self):
+        with self._lock:
+            # Always read the file again: the modification time might not
+            # be precise enough to catch a concurrent update
+            self._mtime = None
+            self._reload()
+            fd, filename = tempfile.mkstemp(
+                prefix=os.path.basename(self.filename) + "-",
+                dir=os.path.dirname(self.filename),
+            )
+            with os.fdopen(fd, "w") as f:
+                json.dump(
+                    {"version": 3, "labels": self._labels, "figures": self._figures}, f
+                )
+            os.replace(filename, self.filename)
+            self._new.clear()
+            self._new_figures.clear()
+            self._removed.clear()
+            self._mtime = self._stat()
+
+
+@contextlib.contextmanager
+def file_lock(filename):
+    """Hold an exclusive lock on ``filename`` (between processes).
+
+    The lock is actually taken on a companion file ``filename.lock``.
+    """
+    with open(filename + ".lock", "a") as f:
+        if fcntl is not None:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+            return
+        # msvcrt locks bytes from the current position (here, the first
+        # byte), and gives up after 10 seconds
+        f.seek(0)
+        while True:
+            try:
+                msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+                break
+            except OSError as e:
+                if e.errno != errno.EDEADLOCK:
+                    raise
+        try:
+            yield
+        finally:
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
 
 
 def read_index():
-    filename = stylesheet.full_path(INDEX_FILENAME)
-    if not pathlib.Path(filename).exists():
-        write_index({})
-    with open(filename, "r") as f:
-        return json.load(f)
+    """Return the label index of the current output directory.
+
+    There is one index object per process (and output directory).
+    """
+    filename = os.path.abspath(stylesheet.full_path(INDEX_FILENAME))
+    if filename not in __indices:
+        if not __indices:
+            atexit.register(flush_index)
+        __indices[filename] = LabelIndex(filename)
+    return __indices[filename]
+
+
+def flush_index():
+    for index in __indices.values():
+        index.flush()
+
+
+def label_basename(contents):
+    """Return the basename of the label with the specified contents.
+
+    The basename is a hash of the XeLaTeX source of the label.
+    """
+    source = LATEX_CODE.format(LATEX_PAGE.format(contents))
+    key = hashlib.sha1(source.encode("utf-8")).hexdigest()[:20]
+    basename = "label-" + key
+    if SHARD_LENGTH > 0:
+        basename = key[:SHARD_LENGTH] + "/" + basename
+    return basename
+
+
+def engine_version():
+    try:
+        process = subprocess.run(
+            [XELATEX_COMMAND, "--version"],
+            stdin=subprocess.DEVNULL,
+            capture_output=True,
+            text=True,
+            timeout=XELATEX_TIMEOUT,
+        )
+    except (OSError, subprocess.TimeoutExpired):
+        return ""
+    return process.stdout.partition("\n")[0]
+
+
+def preamble_format():
+    """Return the name of the precompiled format of the preamble.
+
+    The format is built (in the output directory) if necessary. Returns
+    ``None`` if the format cannot be built.
+    """
+    with __format_lock:
+        directory = os.path.abspath(stylesheet.full_path(""))
+        if directory in __formats:
+            return __formats[directory]
+        key = hashlib.sha1((LATEX_CODE + engine_version()).encode("utf-8"))
+        name = "{}-{}".format(FORMAT_BASENAME, key.hexdigest()[:12])
+        # Concurrent processes would otherwise all build the format
+        with file_lock(os.path.join(directory, FORMAT_BASENAME)):
+            failed = os.path.join(directory, name + ".failed")
+            if not os.path.exists(os.path.join(directory, name + ".fmt")):
+                if os.path.exists(failed):
+                    name = None
+                else:
+                    # Failures of former versions of the preamble
+                    for filename in glob.glob(
+                        os.path.join(directory, FORMAT_BASENAME + "-*.failed")
+                    ):
+                        os.remove(filename)
+                    if not build_format(directory, name):
+                        with open(failed, "w"):
+                            pass
+                        name = None
+        __formats[directory] = name
+        return name
+
+
+def build_format(directory, name):
+    with tempfile.TemporaryDirectory(
+        prefix=FORMAT_BASENAME + "-", dir=directory
+    ) as workdir:
+        with open(os.path.join(workdir, FORMAT_BASENAME + ".tex"), "w") as f:
+            f.write(LATEX_CODE.format(""))
+        options = ["-ini", "-jobname=" + name, "&xelatex", "mylatexformat.ltx"]
+        if not (
+            run_xelatex(FORMAT_BASENAME, workdir, options)
+            and os.path.exists(os.path.join(workdir, name + ".fmt"))
+        ):
+            return False
+        # Remove formats of former versions of the preamble
+        for filename in glob.glob(os.path.join(directory, FORMAT_BASENAME + "-*.fmt")):
+            os.remove(filename)
+        os.replace(
+            os.path.join(workdir, name + ".fmt"), os.path.join(directory, name + ".fmt")
+        )
+        return True
+
+
+def run_xelatex(jobname, cwd, options=(), fmt=None):
+    """Run XeLaTeX non-interactively on ``jobname.tex``.
+
+    If ``fmt`` is not ``None``, XeLaTeX starts from this precompiled
+    format, which must be located in the output directory.
+
+    Returns ``True`` on success. A job that does not complete within
+    ``XELATEX_TIMEOUT`` seconds is killed and considered as failed.
+    """
+    env = None
+    options = list(options)
+    if fmt is not None:
+        options.append("-fmt=" + fmt)
+        # The trailing separator appends the default search path
+        env = dict(
+            os.environ,
+            TEXFORMATS=os.path.abspath(stylesheet.full_path("")) + os.pathsep,
+        )
+    try:
+        process = subprocess.run(
+            [
+                XELATEX_COMMAND,
+                "-interaction=nonstopmode",
+                "-halt-on-error",
+                *options,
+                jobname + ".tex",
+            ],
+            cwd=cwd,
+            env=env,
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+            timeout=XELATEX_TIMEOUT,
+        )
+    except subprocess.TimeoutExpired:
+        return False
+    return process.returncode == 0
+
+
+def compile_batch(batch, fmt=None):
+    """Compile a list of ``(contents, basename)`` pairs in one XeLaTeX run.
+
+    The job runs in its own temporary directory, so that several jobs
+    can run concurrently. If the compilation fails, the batch is split
+    in halves which are compiled separately, in order to isolate the
+    faulty labels.
+
+    Returns a dictionary that maps the basename of each label to its
+    geometry, ``(size, baseline)``, or to ``None`` if the label could
+    not be compiled. The log of each failed label is copied to the
+    output directory.
+    """
+    # Not a lazy import: batches are compiled in threads (see lazy.py)
+    import PyPDF2
+
+    with tempfile.TemporaryDirectory(
+        prefix=BATCH_BASENAME + "-", dir=stylesheet.full_path("")
+    ) as workdir:
+        filename = os.path.join(workdir, BATCH_BASENAME + ".tex")
+        with open(filename, "w") as f:
+            f.write(
+                LATEX_CODE.format("\n".join(LATEX_PAGE.format(c) for c, _ in batch))
+            )
+        if run_xelatex(BATCH_BASENAME, workdir, fmt=fmt):
+            with open(os.path.join(workdir, BATCH_BASENAME + ".log")) as f:
+                depths = [float(d) for d in LABEL_DEPTH_PATTERN.findall(f.read())]
+            if len(depths) != len(batch):
+                depths = [None] * len(batch)
+            geometry = {}
+            filename = os.path.join(workdir, BATCH_BASENAME + ".pdf")
+            with open(filename, "rb") as stream:
+                reader = PyPDF2.PdfFileReader(stream)
+                if reader.getNumPages() != len(batch):
+                    raise RuntimeError(
+                        "expected {} pages in {}, got {}".format(
+                            len(batch), filename, reader.getNumPages()
+                        )
+                    )
+                for i, (_, basename) in enumerate(batch):
+                    page = reader.getPage(i)
+                    x1, y1, x2, y2 = [float(x) for x in page.mediaBox]
+                    baseline = None
+                    if depths[i] is not None:
+                        baseline = depths[i] * 72 / 72.27  # TeX pt to PDF pt
+                    geometry[basename] = ((x2 - x1, y2 - y1), baseline)
+                    writer = PyPDF2.PdfFileWriter()
+                    writer.addPage(page)
+                    # Other processes may be looking for this label
+                    filename = os.path.join(workdir, "page{}.pdf".format(i))
+                    with open(filename, "wb") as f:
+                        writer.write(f)
+                    os.replace(filename, stylesheet.full_path(basename + ".pdf"))
+            return geometry
+        if len(batch) == 1:
+            if fmt is not None:
+                # Rule out a problem with the precompiled format
+                return compile_batch(batch)
+            log = os.path.join(workdir, BATCH_BASENAME + ".log")
+            if os.path.exists(log):
+                shutil.copyfile(log, stylesheet.full_path(batch[0][1] + ".log"))
+            return {batch[0][1]: None}
+    half = len(batch) // 2
+    geometry = compile_batch(batch[:half], fmt)
+    geometry.update(compile_batch(batch[half:], fmt))
+    return geometry
+
+
+def prepare(contents, labels):
+    """Write the sources of the missing labels in ``contents``.
+
+    Returns the list of ``(contents, basename)`` pairs of the labels
+    that must be compiled. Labels that were compiled earlier, but are
+    missing from the index, are added to the index.
+    """
+    pairs = []
+    for contents_ in dict.fromkeys(contents):
+        if contents_ in labels:
+            continue
+        basename = label_basename(contents_)
+        if os.path.exists(stylesheet.full_path(basename + ".pdf")):
+            labels[contents_] = basename
+            continue
+        # Standalone source of the label, which can be compiled on its own
+        filename = stylesheet.full_path(basename + ".tex")
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        with open(filename, "w") as f:
+            f.write(LATEX_CODE.format(LATEX_PAGE.format(contents_)))
+        pairs.append((contents_, basename))
+    return pairs
 
 
 def create(contents, labels):
     if contents in labels:
         raise RuntimeError()
-    basename = "label" + datetime.datetime.now().strftime("%Y%m%d%H%M%S")
-    filename = stylesheet.full_path(basename + ".tex")
-    with open(filename, "w") as f:
-        f.write(LATEX_CODE.format(contents))
-    subprocess.run([XELATEX_COMMAND, basename + ".tex"], cwd=stylesheet.full_path(""))
-    labels[contents] = basename
-    write_index(labels)
-    return basename
+    create_all([contents], labels)
+    return labels[contents]
+
+
+def create_all(contents, labels, jobs=None):
+    """Generate all missing labels in ``contents``.
+
+    The labels are split in at most ``jobs`` batches (defaults to the
+    value set in the stylesheet), which are compiled concurrently; each
+    batch costs one XeLaTeX run. Returns the list of basenames of the
+    newly created labels.
+    """
+    pairs = prepare(contents, labels)
+    if not pairs:
+        return []
+    if jobs is None:
+        jobs = stylesheet.label_jobs()
+    jobs = max(1, min(jobs, len(pairs)))
+
+    fmt = preamble_format()
+    geometry = {}
+    with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as executor:
+        batches = (pairs[i::jobs] for i in range(jobs))
+        for geometry_ in executor.map(compile_batch, batches, [fmt] * jobs):
+            geometry.update(geometry_)
+
+    created, failures = [], []
+    for contents_, basename in pairs:
+        if geometry[basename] is None:
+            failures.append((contents_, basename))
+        else:
+            labels.add(contents_, basename, *geometry[basename])
+            created.append(basename)
+    if failures:
+        raise RuntimeError(
+            "XeLaTeX failed to compile the following labels:\n"
+            + "\n".join(
+                "    {} (see {}.log)".format(c, stylesheet.full_path(b))
+                for c, b in failures
+            )
+        )
+    return created
+
+
+class Prefetcher:
+    """Compile labels in the background, as soon as they are created.
+
+    Labels are queued by ``schedule()``, which returns a future. At most
+    ``jobs`` workers run concurrently; each worker compiles, in one
+    XeLaTeX run, all the labels that were queued since its previous run.
+    """
+
+    def __init__(self, jobs):
+        self.jobs = jobs
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=jobs)
+        self._lock = threading.Lock()
+        self._queue = []
+        self._futures = {}
+        self._workers = 0
+
+    def schedule(self, contents):
+        with self._lock:
+            if contents in self._futures:
+                return self._futures[contents]
+            future = concurrent.futures.Future()
+            self._futures[contents] = future
+            self._queue.append(contents)
+            if self._workers < self.jobs:
+                self._workers += 1
+                self._executor.submit(self._work)
+        return future
+
+    def _work(self):
+        while True:
+            # Let the queue fill up, so that it is compiled in one run
+            time.sleep(PREFETCH_DELAY)
+            with self._lock:
+                queue, self._queue = self._queue, []
+                if not queue:
+                    self._workers -= 1
+                    return
+            labels = read_index()
+            try:
+                pairs = prepare(queue, labels)
+                if pairs:
+                    geometry = compile_batch(pairs, preamble_format())
+                    for contents, basename in pairs:
+                        if geometry[basename] is not None:
+                            labels.add(contents, basename, *geometry[basename])
+            except Exception as e:
+                for contents in queue:
+                    self._futures[contents].set_exception(e)
+                continue
+            for contents in queue:
+                if contents in labels:
+                    self._futures[contents].set_result(labels[contents])
+                else:
+                    self._futures[contents].set_exception(
+                        RuntimeError("XeLaTeX failed to compile {}".format(contents))
+                    )
+
+    def shutdown(self):
+        self._executor.shutdown(wait=True)
+
+
+def schedule(contents):
+    """Schedule the compilation of a label (if ``prefetch()`` is active).
+
+    Returns a future, or ``None``.
+    """
+    if __prefetcher is None or not stylesheet.prefetch_labels():
+        return None
+    if stylesheet.label_overlay() == "tex":
+        return None
+    if contents in read_index():
+        return None
+    return __prefetcher.schedule(contents)
+
+
+@contextlib.contextmanager
+def prefetch(jobs=None):
+    """Compile labels in the background within the ``with`` block.
+
+    Each label is scheduled for compilation when it is created, so that
+    XeLaTeX runs while the figures are being drawn. ``insert_labels``
+    then only waits for the labels that are not ready yet.
+    """
+    global __prefetcher
+    if __prefetcher is not None:
+        yield
+        return
+    if jobs is None:
+        jobs = stylesheet.label_jobs()
+    __prefetcher = Prefetcher(jobs)
+    try:
+        yield
+    finally:
+        __prefetcher.shutdown()
+        __prefetcher = None
+
+
+@functools.lru_cache(maxsize=LABEL_CACHE_SIZE)
+def _read_page(filename, mtime):
+    # The modification time is part of the key: a label that is modified
+    # on disk is read again
+    import PyPDF2
+
+    with open(filename, "rb") as f:
+        stream = io.BytesIO(f.read())
+    return PyPDF2.PdfFileReader(stream).getPage(0)
+
+
+def read_label_page(basename):
+    """Return the (parsed) page of the label with the specified basename.
+
+    Pages are kept in a cache of at most ``LABEL_CACHE_SIZE`` pages,
+    with LRU eviction, so that labels used by several figures are read
+    once per build (or once per change in a long-running process).
+    """
+    filename = os.path.abspath(stylesheet.full_path(basename + ".pdf"))
+    return _read_page(filename, os.stat(filename).st_mtime_ns)
 
 
 class Label:
@@ -88,23 +800,67 @@ class Label:
         self.anchor = anchor
         self.y_upwards = y_upwards
 
+    @property
+    def contents(self):
+        return self._contents
+
+    @contents.setter
+    def contents(self, value):
+        self._contents = value
+        self.future = schedule(value)
+
+    def wait(self):
+        """Wait for the scheduled compilation of the label (if any)."""
+        if self.future is not None:
+            concurrent.futures.wait([self.future])
+
     @property
     def basename(self):
+        self.wait()
         labels = read_index()
         if not self.contents in labels:
             create(self.contents, labels)
         return labels[self.contents]
 
-    def insert(self, page):
-        filename = stylesheet.full_path(self.basename + ".pdf")
-        label = PyPDF2.PdfFileReader(filename).getPage(0)
-        x1, y1, x2, y2 = [float(x) for x in label.mediaBox]
+    @property
+    def size(self):
+        """Width and height of the label, in PDF points.
+
+        The size is read from the index. For labels compiled by former
+        versions of this module, it is read once from the PDF file, and
+        stored in the index.
+        """
+        basename = self.basename
+        labels = read_index()
+        entry = labels.entry(self.contents)
+        if "size" not in entry:
+            mediaBox = read_label_page(basename).mediaBox
+            x1, y1, x2, y2 = [float(x) for x in mediaBox]
+            labels.add(
+                self.contents, basename, (x2 - x1, y2 - y1), entry.get("baseline")
+            )
+            entry = labels.entry(self.contents)
+        return tuple(entry["size"])
+
+    @property
+    def baseline(self):
+        """Height of the baseline above the bottom of the label (or ``None``)."""
+        self.size  # Make sure that the label exists
+        return read_index().entry(self.contents).get("baseline")
+
+    def bbox(self, page_height):
+        """Return the bounding box ``(x1, y1, x2, y2)`` of the label.
+
+        The coordinates are PDF coordinates on a page of the specified
+        height. The PDF of the label is not opened.
+        """
+        width, height = self.size
         x, y = self.position
         if not self.y_upwards:
-            y = float(page.mediaBox[3]) - float(page.mediaBox[1]) - y
-        x -= self.anchor[0] * (x2 - x1)
-        y -= self.anchor[1] * (y2 - y1)
-        page.mergeTranslatedPage(label, x, y)
+            y = page_height - y
+        x -= self.anchor[0] * width
+        y -= self.anchor[1] * height
+        return x, y, x + width, y + height
 
 
 def label_json_formatter(o):
@@ -119,13 +875,312 @@ def label_json_formatter(o):
         raise TypeError()
 
 
-def insert_labels(basename, labels):
+def overlay_labels(basename, labels, fmt=None):
+    """Typeset all labels over the bare figure in one XeLaTeX run.
+
+    This produces ``<basename>.pdf`` from ``<basename>-bare.pdf``, the
+    labels being typeset directly (their PDF is not used).
+    """
+    directory = stylesheet.full_path("")
+    with tempfile.TemporaryDirectory(
+        prefix=OVERLAY_BASENAME + "-", dir=directory
+    ) as workdir:
+        bare = os.path.relpath(stylesheet.full_path(basename + "-bare.pdf"), workdir)
+        lines = []
+        for label in labels:
+            x, y = label.position
+            # Box 1 holds the bare figure
+            y = "{:.4f}bp".format(y) if label.y_upwards else "\\ht1-{:.4f}bp".format(y)
+            lines.append(
+                LATEX_OVERLAY_LABEL.format(x, y, *label.anchor, label.contents)
+            )
+        with open(os.path.join(workdir, OVERLAY_BASENAME + ".tex"), "w") as f:
+            f.write(
+                LATEX_CODE.format(
+                    LATEX_OVERLAY.format(bare.replace(os.sep, "/"), "\n".join(lines))
+                )
+            )
+        if not run_xelatex(OVERLAY_BASENAME, workdir, fmt=fmt):
+            log = os.path.join(workdir, OVERLAY_BASENAME + ".log")
+            if os.path.exists(log):
+                shutil.copyfile(log, stylesheet.full_path(basename + ".log"))
+            raise RuntimeError(
+                "XeLaTeX failed to overlay the labels of {} (see {}.log)".format(
+                    basename, stylesheet.full_path(basename)
+                )
+            )
+        os.replace(
+            os.path.join(workdir, OVERLAY_BASENAME + ".pdf"),
+            stylesheet.full_path(basename + ".pdf"),
+        )
+
+
+def pdf_fingerprint(obj, memo):
+    """Return a hash of a PDF object, which does not depend on its location.
+
+    Indirect references are followed, so that two copies of the same
+    object (e.g. a font) in two different files have the same
+    fingerprint. ``memo`` maps already visited indirect objects to their
+    fingerprint.
+    """
+    from PyPDF2.generic import (
+        ArrayObject,
+        DictionaryObject,
+        IndirectObject,
+        StreamObject,
+    )
+
+    h = hashlib.sha1()
+    if isinstance(obj, IndirectObject):
+        key = (id(obj.pdf), obj.generation, obj.idnum)
+        if key not in memo:
+            memo[key] = repr(key)  # Guard against cycles
+            memo[key] = pdf_fingerprint(obj.getObject(), memo)
+        return memo[key]
+    elif isinstance(obj, DictionaryObject):
+        h.update(type(obj).__name__.encode("ascii"))
+        for key in sorted(obj.keys()):
+            h.update(key.encode("utf-8"))
+            h.update(pdf_fingerprint(obj.raw_get(key), memo).encode("ascii"))
+        if isinstance(obj, StreamObject):
+            h.update(obj._data)
+    elif isinstance(obj, ArrayObject):
+        h.update(b"array")
+        for item in obj:
+            h.update(pdf_fingerprint(item, memo).encode("ascii"))
+    else:
+        stream = io.BytesIO()
+        obj.writeToStream(stream, None)
+        h.update(type(obj).__name__.encode("ascii"))
+        h.update(stream.getvalue())
+    return h.hexdigest()
+
+
+def share_resources(obj, shared, memo):
+    """Return a copy of the resources ``obj`` where all indirect objects
+    are replaced with the first equivalent object found in ``shared``.
+
+    ``shared`` maps fingerprints to indirect objects; it is updated.
+    Since equivalent objects are then the same indirect object, they are
+    written only once to the output file.
+    """
+    from PyPDF2.generic import ArrayObject, DictionaryObject, IndirectObject
+
+    if isinstance(obj, IndirectObject):
+        return shared.setdefault(pdf_fingerprint(obj, memo), obj)
+    elif isinstance(obj, DictionaryObject):
+        return DictionaryObject(
+            {key: share_resources(value, shared, memo) for key, value in obj.items()}
+        )
+    elif isinstance(obj, ArrayObject):
+        return ArrayObject(share_resources(item, shared, memo) for item in obj)
+    else:
+        return obj
+
+
+def compressed_stream(data):
+    from PyPDF2.generic import DecodedStreamObject
+
+    stream = DecodedStreamObject()
+    stream.setData(data)
+    return stream.flateEncode()
+
+
+def place_labels(page, labels, writer):
+    """Place the labels on the page, as form XObjects.
+
+    Each distinct label is turned into one form XObject (added to
+    ``writer``), which is used by all occurrences of the label. The
+    resources of the labels are shared (see ``share_resources``). The
+    placement instructions are appended to the contents of the page as
+    one single compressed stream.
+    """
+    from PyPDF2.generic import ArrayObject, DictionaryObject, NameObject
+
+    height = float(page.mediaBox[3]) - float(page.mediaBox[1])
+    resources = DictionaryObject(page["/Resources"].getObject())
+    xobjects = DictionaryObject()
+    if "/XObject" in resources:
+        xobjects.update(resources["/XObject"].getObject())
+    names = {}
+    shared, memo = {}, {}
+    instructions = []
+    for label in labels:
+        basename = label.basename
+        if basename not in names:
+            label_page = read_label_page(basename)
+            i = len(names)
+            while "/Label{}".format(i) in xobjects:
+                i += 1
+            names[basename] = NameObject("/Label{}".format(i))
+            contents = label_page.getContents()
+            form = compressed_stream(b"" if contents is None else contents.getData())
+            form[NameObject("/Type")] = NameObject("/XObject")
+            form[NameObject("/Subtype")] = NameObject("/Form")
+            form[NameObject("/BBox")] = label_page.mediaBox
+            form[NameObject("/Resources")] = share_resources(
+                label_page["/Resources"].getObject(), shared, memo
+            )
+            xobjects[names[basename]] = writer._addObject(form)
+        x, y, _, _ = label.bbox(height)
+        instructions.append(
+            "q 1 0 0 1 {:.4f} {:.4f} cm {} Do Q".format(x, y, names[basename])
+        )
+    resources[NameObject("/XObject")] = xobjects
+    page[NameObject("/Resources")] = resources
+
+    contents = page["/Contents"]
+    if isinstance(contents.getObject(), ArrayObject):
+        contents = list(contents.getObject())
+    else:
+        contents = [contents]
+    # Isolate the graphics state of the figure
+    push = writer._addObject(compressed_stream(b"q\n"))
+    pop = writer._addObject(
+        compressed_stream("\n".join(["Q"] + instructions).encode("ascii"))
+    )
+    page[NameObject("/Contents")] = ArrayObject([push, *contents, pop])
+
+
+def insert_labels(basename, labels, jobs=None):
+    if __pending is not None:
+        __pending.append((basename, list(labels)))
+        return
+    if stylesheet.label_overlay() == "tex":
+        overlay_labels(basename, labels, preamble_format())
+        return
+    for label in labels:
+        label.wait()
+    import PyPDF2
+
+    create_all((label.contents for label in labels), read_index(), jobs)
     filename = stylesheet.full_path(basename + "-bare.pdf")
     page = PyPDF2.PdfFileReader(filename).getPage(0)
-    for label in labels:
-        label.insert(page)
     writer = PyPDF2.PdfFileWriter()
+    place_labels(page, labels, writer)
     writer.addPage(page)
     filename = stylesheet.full_path(basename + ".pdf")
     with open(filename, "wb") as f:
         writer.write(f)
+    read_index().set_references(basename, (label.basename for label in labels))
+
+
+@contextlib.contextmanager
+def batch(jobs=None):
+    """Defer the insertion of labels until the end of the ``with`` block.
+
+    All labels required by the figures drawn within the block are then
+    compiled in one go (using at most ``jobs`` concurrent XeLaTeX runs),
+    before being inserted. With the "tex" overlay, the figures are
+    composed concurrently instead.
+    """
+    global __pending
+    if __pending is not None:
+        # Nested call: the outermost block does the work
+        yield
+        return
+    __pending = []
+    try:
+        yield
+        pending = __pending
+    finally:
+        __pending = None
+    if stylesheet.label_overlay() == "tex":
+        if jobs is None:
+            jobs = stylesheet.label_jobs()
+        fmt = preamble_format()
+        with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as executor:
+            futures = [
+                executor.submit(overlay_labels, basename, labels, fmt)
+                for basename, labels in pending
+            ]
+        for future in futures:
+            future.result()
+        return
+    for _, labels in pending:
+        for label in labels:
+            label.wait()
+    create_all(
+        (label.contents for _, labels in pending for label in labels),
+        read_index(),
+        jobs,
+    )
+    for basename, labels in pending:
+        insert_labels(basename, labels)
+    flush_index()
+
+
+def collect_garbage(dry_run=False):
+    """Delete the label files that are not used by any figure.
+
+    The files of all labels that are not referenced in the "figures"
+    entry of the index are deleted, and the corresponding entries are
+    removed from the index. Returns the list of the deleted files (the
+    files that would be deleted if ``dry_run`` is ``True``).
+
+    The labels used by a figure are only known once this figure has been
+    built (with the "merge" overlay). Raises ``RuntimeError``, and deletes
+    nothing, if no figure recorded its labels, or if some figures of the
+    build manifest did not.
+    """
+    # Not imported at module level: manifest imports this module
+    import manifest
+
+    index = read_index()
+    if not index.figures():
+        raise RuntimeError(
+            "no figure recorded the labels it uses: build the figures first"
+        )
+    unknown = [
+        name
+        for name in sorted(manifest.read_manifest().figures)
+        if not manifest.figure_basenames(name)
+    ]
+    if unknown:
+        raise RuntimeError(
+            "the labels used by the following figures are unknown "
+            '(build them again, with the "merge" overlay): ' + ", ".join(unknown)
+        )
+    referenced = index.references()
+    directory = stylesheet.full_path("")
+    deleted = []
+    for root, _, files in os.walk(directory):
+        for name in files:
+            stem, ext = os.path.splitext(name)
+            if ext not in LABEL_EXTENSIONS or not LABEL_PATTERN.fullmatch(stem):
+                continue
+            basename = os.path.relpath(os.path.join(root, stem), directory)
+            if basename.replace(os.sep, "/") not in referenced:
+                deleted.append(os.path.join(root, name))
+    if not dry_run:
+        for filename in deleted:
+            os.remove(filename)
+            # Remove empty shards
+            parent = os.path.dirname(filename)
+            if not os.path.samefile(parent, directory) and not os.listdir(parent):
+                os.rmdir(parent)
+        index.prune(referenced)
+        index.flush()
+    return deleted
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Manage the figure labels.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    gc = subparsers.add_parser("gc", help="delete the labels not used by any figure")
+    gc.add_argument(
+        "--dry-run", action="store_true", help="only list the files to be deleted"
+    )
+    args = parser.parse_args()
+
+    if args.command == "gc":
+        try:
+            deleted = collect_garbage(args.dry_run)
+        except RuntimeError as e:
+            parser.error(str(e))
+        for filename in deleted:
+            print(filename)
+
+
+if __name__ == "__main__":
+    main()
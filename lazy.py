@@ -0,0 +1,51 @@
+"""
+Lazy imports of heavy dependencies.
+
+``lazy_import(name)`` returns module ``name`` right away, but the module
+is only executed when one of its attributes is first accessed. This way,
+the build modules (``stylesheet``, ``labelling``, ``manifest`` and
+``figures``) can be imported (e.g. to check which figures are stale)
+without paying for the import of cairo or of the drawing modules, which
+import numpy and cairo right away.
+
+Only top-level packages can be imported lazily: finding a submodule
+requires the execution of its parent package.
+
+The loading of a lazy module is not thread-safe (e.g. in Python 3.11): it
+must be first accessed by one thread only. Modules which are first used
+by worker threads (e.g. PyPDF2, when labels are compiled) are rather
+imported by the functions which use them, with a plain ``import``
+statement.
+"""
+import importlib.util
+import sys
+
+
+def lazy_import(name):
+    """Return module ``name``, which is executed on first attribute access.
+
+    If the module is already imported, it is returned as is. Raises
+    ``ModuleNotFoundError`` right away if the module cannot be found.
+    """
+    try:
+        return sys.modules[name]
+    except KeyError:
+        pass
+    if "." in name:
+        raise ValueError("not a top-level module: {}".format(name))
+    spec = importlib.util.find_spec(name)
+    if spec is None:
+        raise ModuleNotFoundError("No module named {!r}".format(name), name=name)
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    return module
+
+
+def is_loaded(name):
+    """Return ``True`` if module ``name`` was imported and actually executed."""
+    module = sys.modules.get(name)
+    # Once executed, lazy modules are turned into plain modules
+    return module is not None and not isinstance(module, importlib.util._LazyModule)
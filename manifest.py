@@ -0,0 +1,157 @@
+"""
+Build manifest, used to skip the figures whose inputs did not change.
+
+The manifest is a JSON file (manifest.json, in the output directory),
+which records a fingerprint of the inputs of each figure module, and
+the list of its outputs. The syntax is
+
+    {
+        "version": 1,
+        "figures": {
+            "module name": {
+                "fingerprint": sha1,
+                "outputs": [filenames]
+            }
+        }
+    }
+
+The inputs of a figure module are
+
+- its source, and the source of the local modules it imports (directly
+  or not; imports are found by parsing the sources, without importing
+  them),
+- the stylesheet,
+- the label PDFs used by its figures (according to the label index).
+
+The outputs of a figure module are the PDF files of the output directory
+whose name starts with the name of the module. A figure module is up to
+date if its fingerprint did not change, and all its outputs still exist.
+"""
+import ast
+import glob
+import hashlib
+import json
+import os
+import os.path
+import tempfile
+
+import labelling
+import stylesheet
+
+MANIFEST_FILENAME = "manifest.json"
+SOURCE_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+
+
+def module_path(name):
+    return os.path.join(SOURCE_DIRECTORY, name + ".py")
+
+
+def dependencies(name):
+    """Return the names of the local modules required by module ``name``.
+
+    The returned list (sorted) includes ``name`` itself.
+    """
+    names = set()
+    stack = [name]
+    while stack:
+        name = stack.pop()
+        if name in names:
+            continue
+        names.add(name)
+        with open(module_path(name), "rb") as f:
+            tree = ast.parse(f.read(), module_path(name))
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Import):
+                imported = [alias.name for alias in node.names]
+            elif isinstance(node, ast.ImportFrom) and node.level == 0:
+                imported = [node.module]
+            else:
+                continue
+            for module in imported:
+                module = module.split(".")[0]
+                if os.path.exists(module_path(module)):
+                    stack.append(module)
+    return sorted(names)
+
+
+def figure_basenames(name):
+    """Return the basenames of the figures of module ``name`` in the label index."""
+    return [
+        figure
+        for figure in labelling.read_index().figures()
+        if figure == name or figure.startswith(name + "-")
+    ]
+
+
+def fingerprint(name):
+    """Return the fingerprint of the inputs of figure module ``name``."""
+    h = hashlib.sha1()
+
+    def update(key, filename):
+        h.update(key.encode("utf-8") + b"\0")
+        try:
+            with open(filename, "rb") as f:
+                h.update(hashlib.sha1(f.read()).digest())
+        except FileNotFoundError:
+            h.update(b"missing")
+
+    for module in dependencies(name):
+        update(module, module_path(module))
+    update("stylesheet", stylesheet.filename())
+    index = labelling.read_index()
+    labels = set()
+    for figure in figure_basenames(name):
+        labels |= index.references(figure)
+    for basename in sorted(labels):
+        update(basename, stylesheet.full_path(basename + ".pdf"))
+    return h.hexdigest()
+
+
+def outputs(name):
+    """Return the names of the current output files of figure module ``name``."""
+    pattern = stylesheet.full_path(name)
+    filenames = glob.glob(pattern + ".pdf") + glob.glob(pattern + "-*.pdf")
+    return sorted(os.path.basename(filename) for filename in filenames)
+
+
+class Manifest:
+    def __init__(self, filename):
+        self.filename = filename
+        try:
+            with open(filename, "r") as f:
+                self.figures = json.load(f)["figures"]
+        except FileNotFoundError:
+            self.figures = {}
+
+    def status(self, name, fingerprint):
+        """Return why figure module ``name`` is stale (``None`` if up to date)."""
+        entry = self.figures.get(name)
+        if entry is None or not entry["outputs"]:
+            return "new"
+        if entry["fingerprint"] != fingerprint:
+            return "inputs changed"
+        for filename in entry["outputs"]:
+            if not os.path.exists(stylesheet.full_path(filename)):
+                return "missing " + filename
+        return None
+
+    def outputs(self, name):
+        """Return the recorded outputs of figure module ``name``."""
+        return self.figures.get(name, {}).get("outputs", [])
+
+    def update(self, name, fingerprint, outputs):
+        self.figures[name] = {"fingerprint": fingerprint, "outputs": outputs}
+
+    def flush(self):
+        fd, filename = tempfile.mkstemp(
+            prefix=os.path.basename(self.filename) + "-",
+            dir=os.path.dirname(self.filename),
+        )
+        with os.fdopen(fd, "w") as f:
+            json.dump({"version": 1, "figures": self.figures}, f, indent=4)
+        os.replace(filename, self.filename)
+
+
+def read_manifest():
+    """Return the manifest of the current output directory."""
+    return Manifest(stylesheet.full_path(MANIFEST_FILENAME))
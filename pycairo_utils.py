@@ -2,9 +2,16 @@
 Helper functions for drawing with PyCairo.
 """
 import math
+
+from collections import deque
+from itertools import starmap
+
 import cairo
+import numpy as np
+
+import stylesheet
 
-from geometry import project
+from geometry import face_neighbors, project, simplify
 from labelling import Label
 
 
@@ -15,12 +22,98 @@ def draw_line(ctx, x1, y1, x2, y2, stroke=True):
         ctx.stroke()
 
 
-def draw_polyline(ctx, xy, move_to_first=True):
-    it = iter(xy)
+def draw_polyline(ctx, xy, move_to_first=True, tolerance=None, close=False):
+    """Append the polyline ``xy`` (an array of shape ``(N, 2)``) to the current path.
+
+    Vertices are first removed by ``simplify()``, with a tolerance of
+    ``tolerance`` in device units (defaults to the stylesheet). Both ends
+    of the polyline are always retained.
+    """
+    if not hasattr(xy, "__len__"):
+        xy = list(xy)
+    if tolerance is None:
+        tolerance = stylesheet.simplify_tolerance()
+    if tolerance > 0.0:
+        tolerance = math.hypot(*ctx.device_to_user_distance(tolerance, 0.0))
+        xy = simplify(xy, tolerance)
+    points = np.asarray(xy, dtype=float).tolist()
+    if not points:
+        return
     if move_to_first:
-        ctx.move_to(*next(it))
-    for x, y in it:
-        ctx.line_to(x, y)
+        ctx.move_to(*points[0])
+        points = points[1:]
+    # Consume the iterator in C, rather than in a Python loop
+    deque(starmap(ctx.line_to, points), maxlen=0)
+    if close:
+        ctx.close_path()
+
+
+def draw_polylines(ctx, polylines, close=False, tolerance=None):
+    """Append each of ``polylines`` to the current path, as a new sub-path."""
+    for xy in polylines:
+        draw_polyline(ctx, xy, tolerance=tolerance, close=close)
+
+
+def build_path(ctx, polylines, close=False, tolerance=None):
+    """Replace the current path with ``polylines`` and return a copy of it.
+
+    The returned path can be appended again (``ctx.append_path()``), e.g.
+    to stroke a path that has already been filled.
+    """
+    ctx.new_path()
+    draw_polylines(ctx, polylines, close, tolerance)
+    return ctx.copy_path()
+
+
+def draw_mesh(ctx, mesh, colors, projection=project, cull=True):
+    """Draw ``mesh`` (see ``geometry.tessellate()``) with the painter's algorithm.
+
+    Faces are sorted by decreasing depth of their centroid, and filled with
+    ``colors[group]``. If ``cull`` is true, faces seen from behind are not
+    drawn, and the silhouette edges (between a face seen from the front and
+    a face seen from behind) are flagged; otherwise, each face is filled
+    separately. The flagged edges of each face are stroked (with the
+    current source and line width) right after this face, so that they are
+    hidden by the faces in front of them.
+    """
+    polygons = projection.points(mesh.vertices)[mesh.faces]
+    depth = projection.depth(mesh.vertices)[mesh.faces].mean(axis=1)
+    order = np.argsort(-depth, kind="stable")
+    edges = mesh.edges
+    if cull:
+        x, y = polygons[..., 0], polygons[..., 1]
+        area = np.sum(x * np.roll(y, -1, axis=1) - np.roll(x, -1, axis=1) * y, axis=1)
+        front = area > 0.0
+        neighbors = face_neighbors(mesh)
+        edges = edges | np.where(neighbors >= 0, ~front[neighbors], True)
+        order = order[front[order]]
+
+    source = ctx.get_source()
+    groups = mesh.groups[order].tolist()
+    edges = edges[order]
+    has_edges = edges.any(axis=1).tolist()
+    polygons = polygons[order]
+    # Consecutive faces of the same color are filled at once (no seams).
+    # This requires that they all have the same orientation: otherwise,
+    # overlapping faces would cancel out (nonzero winding rule).
+    current = None
+    for k, group in enumerate(groups):
+        if group != current or not cull:
+            if current is not None:
+                ctx.fill()
+            ctx.set_source_rgb(*colors[group])
+            current = group
+        draw_polyline(ctx, polygons[k], tolerance=0.0, close=True)
+        if has_edges[k]:
+            ctx.fill()
+            current = None
+            ctx.set_source(source)
+            for e in np.flatnonzero(edges[k]):
+                ctx.move_to(*polygons[k, e])
+                ctx.line_to(*polygons[k, (e + 1) % 4])
+            ctx.stroke()
+    if current is not None:
+        ctx.fill()
 
 
 def draw_arrow_head(ctx):
@@ -50,17 +143,17 @@ def draw_arrow(ctx, x1, y1, x2, y2):
     ctx.restore()
 
 
-def draw_frame(ctx, labels=None):
+def draw_frame(ctx, labels=None, projection=project):
     r = 10.0
-    draw_arrow(ctx, 0.0, 0.0, *project(r, 0.0, 0.0))
-    draw_arrow(ctx, 0.0, 0.0, *project(0.0, r, 0.0))
-    draw_arrow(ctx, 0.0, 0.0, *project(0.0, 0.0, r))
+    draw_arrow(ctx, 0.0, 0.0, *projection(r, 0.0, 0.0))
+    draw_arrow(ctx, 0.0, 0.0, *projection(0.0, r, 0.0))
+    draw_arrow(ctx, 0.0, 0.0, *projection(0.0, 0.0, r))
     if labels is not None:
         color = "\\color[rgb]{{{:0.3f}, {:0.3f}, {:0.3f}}}".format(
             *ctx.get_source().get_rgba()
         )
 
-        x, y = project(0.5 * r, 0.0, 0.0)
+        x, y = projection(0.5 * r, 0.0, 0.0)
         labels.append(
             Label(
                 color + r"\(\vec e_x\)",
@@ -69,7 +162,7 @@ def draw_frame(ctx, labels=None):
                 y_upwards=False,
             )
         )
-        x, y = project(0.0, 0.5 * r, 0.0)
+        x, y = projection(0.0, 0.5 * r, 0.0)
         labels.append(
             Label(
                 color + r"\(\vec e_y\)",
@@ -78,7 +171,7 @@ def draw_frame(ctx, labels=None):
                 y_upwards=False,
             )
         )
-        x, y = project(0.0, 0.0, r)
+        x, y = projection(0.0, 0.0, r)
         labels.append(
             Label(
                 color + r"\(\vec e_z\)",
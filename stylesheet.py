@@ -1,49 +1,151 @@
+"""
+Styles of the figures (colors, line widths, output directory...).
+
+The styles are held by a ``Stylesheet`` object, loaded from a JSON file.
+The functions of this module apply to the current stylesheet (see
+``load()`` and ``use()``). Each process (e.g. each worker of a parallel
+build) has its own current stylesheet. Unless another stylesheet was
+loaded before, ``DEFAULT_FILENAME`` (relative to the current directory)
+is loaded on first use, rather than when this module is imported.
+"""
 import json
+import os
 import os.path
 
-import cairo
+from lazy import lazy_import
+
+cairo = lazy_import("cairo")
+
+DEFAULT_FILENAME = "default_stylesheet.json"
+
+
+class Stylesheet:
+    def __init__(self, styles, filename=None):
+        self.styles = styles
+        self.filename = filename
+
+    @classmethod
+    def load(cls, filename):
+        with open(filename, "r") as f:
+            return cls(json.load(f), filename)
+
+    def color(self, key, lightness="dark"):
+        value = self.styles["color"][key]
+        if isinstance(value, str):
+            # Use recursive call in case of double aliases
+            return self.color(value, lightness)
+        else:
+            r, g, b = value[lightness]
+            return r / 255, g / 255, b / 255
+
+    def line_width(self, key):
+        return self.styles["line width"][key]
+
+    def chord_tolerance(self):
+        """Maximum chord error of sampled curves, in user units.
+
+        The stylesheet entry is in device units (PostScript points).
+        """
+        return self.styles.get("chord tolerance", 0.1) / self.styles["unit"]
+
+    def simplify_tolerance(self):
+        """Tolerance of the simplification of polylines, in device units."""
+        return self.styles.get("simplify tolerance", 0.0)
+
+    def label_jobs(self):
+        """Maximum number of concurrent XeLaTeX runs (defaults to the CPU count)."""
+        return self.styles.get("label jobs") or os.cpu_count() or 1
+
+    def prefetch_labels(self):
+        """Compile labels in the background while figures are drawn (off by default)."""
+        return self.styles.get("prefetch labels", False)
+
+    def label_overlay(self):
+        """Method used to insert the labels: "merge" (PyPDF2) or "tex"."""
+        return self.styles.get("label overlay", "merge")
+
+    def geometry_cache(self):
+        """Return the directory of the on-disk geometry cache (``None`` if disabled)."""
+        if self.styles.get("geometry cache", False):
+            return self.full_path("geometry-cache")
+        return None
+
+    def init_cairo_context(self, surface):
+        unit = self.styles["unit"]
+        width, height = self.styles["figure size"]
+        surface.set_size(width * unit, height * unit)
+        ctx = cairo.Context(surface)
+
+        ctx.scale(unit, unit)
+        ctx.translate(0.5 * width, 0.5 * height)  # Place origin at center
+        ctx.scale(1.0, -1.0)  # y points upwards
+        ctx.set_line_cap(cairo.LineCap.ROUND)
+        ctx.set_line_join(cairo.LineJoin.ROUND)
+        return ctx
+
+    def full_path(self, basename):
+        return os.path.join(self.styles["output directory"], basename)
+
 
-__styles = {}
+__current = None
 
 
 def load(filename):
-    with open(filename, "r") as f:
-        # TODO: This is pretty bad
-        global __styles
-        __styles = json.load(f)
+    """Load ``filename`` and make it the current stylesheet."""
+    use(Stylesheet.load(filename))
+
+
+def use(stylesheet):
+    global __current
+    __current = stylesheet
+
+
+def current():
+    if __current is None:
+        load(DEFAULT_FILENAME)
+    return __current
+
+
+def filename():
+    """Return the name of the current stylesheet file."""
+    return current().filename
 
 
 def color(key, lightness="dark"):
-    value = __styles["color"][key]
-    if isinstance(value, str):
-        # Use recursive call in case of double aliases
-        return color(value, lightness)
-    else:
-        r, g, b = value[lightness]
-        return r / 255, g / 255, b / 255
+    return current().color(key, lightness)
 
 
 def line_width(key):
-    return __styles["line width"][key]
+    return current().line_width(key)
 
 
-def init_cairo_context(surface):
-    unit = __styles["unit"]
-    width, height = __styles["figure size"]
-    surface.set_size(width * unit, height * unit)
-    ctx = cairo.Context(surface)
+def chord_tolerance():
+    return current().chord_tolerance()
 
-    ctx.scale(unit, unit)
-    ctx.translate(0.5 * width, 0.5 * height)  # Place origin at center
-    ctx.scale(1.0, -1.0)  # y points upwards
-    ctx.set_line_cap(cairo.LineCap.ROUND)
-    ctx.set_line_join(cairo.LineJoin.ROUND)
-    return ctx
 
+def simplify_tolerance():
+    return current().simplify_tolerance()
+
+
+def label_jobs():
+    return current().label_jobs()
 
-def full_path(basename):
-    return os.path.join(__styles["output directory"], basename)
 
+def prefetch_labels():
+    return current().prefetch_labels()
 
-# This is executed when the module is imported
-load("default_stylesheet.json")
+
+def label_overlay():
+    return current().label_overlay()
+
+
+def geometry_cache():
+    return current().geometry_cache()
+
+
+def init_cairo_context(surface):
+    return current().init_cairo_context(surface)
+
+
+def full_path(basename):
+    return current().full_path(basename)